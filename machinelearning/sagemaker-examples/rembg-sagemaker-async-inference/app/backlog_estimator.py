@@ -0,0 +1,58 @@
+import math
+import time
+from typing import Optional
+
+# Reported drain time while work is pending but nothing has completed yet
+MAX_DRAIN_SECONDS = 3600.0
+
+
+class BacklogEstimator:
+    """EWMA-smoothed backlog and completion rate of the admission queue
+
+    ``update`` is called with the current depth (queued plus in-flight items)
+    and the cumulative number of completed items. Both the depth and the
+    completion rate are smoothed with a time-based EWMA, so bursts shorter
+    than ``half_life`` seconds do not make the scaling signal flap, and the
+    estimated time to drain the backlog is derived from the two.
+    """
+
+    def __init__(self, half_life: float = 30.0):
+        self.half_life = max(0.0, half_life)
+        self.depth: Optional[float] = None
+        self.rate = 0.0
+        self._last_time: Optional[float] = None
+        self._last_completed = 0
+
+    def update(self, depth: int, completed: int, now: Optional[float] = None) -> dict:
+        """Fold in one sample and return the metrics to publish"""
+        now = time.monotonic() if now is None else now
+        if self._last_time is None:
+            self.depth = float(depth)
+        else:
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                alpha = (
+                    1.0 - math.pow(0.5, elapsed / self.half_life)
+                    if self.half_life > 0
+                    else 1.0
+                )
+                rate = (completed - self._last_completed) / elapsed
+                self.depth += alpha * (depth - self.depth)
+                self.rate += alpha * (rate - self.rate)
+        self._last_time = now
+        self._last_completed = completed
+
+        return {
+            "ApproximateBacklogSizePerInstance": self.depth,
+            "ApproximateBacklogSizePerInstanceRaw": float(depth),
+            "CompletionRatePerInstance": self.rate,
+            "EstimatedTimeToDrainSeconds": self.time_to_drain(),
+        }
+
+    def time_to_drain(self) -> float:
+        """Seconds needed to finish the smoothed backlog at the smoothed completion rate"""
+        if not self.depth:
+            return 0.0
+        if self.rate <= 0:
+            return MAX_DRAIN_SECONDS
+        return min(self.depth / self.rate, MAX_DRAIN_SECONDS)
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import logging
+import itertools
+import mimetypes
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ロガーの設定
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logging.getLogger("urllib3").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# ベンチマークの対象とする画像の拡張子
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+def load_corpus(corpus_dir: str) -> List[Dict[str, Any]]:
+    """コーパスの画像をメモリに読み込む（クライアント側のディスク I/O を計測から除く）"""
+    corpus = []
+    for path in sorted(Path(corpus_dir).rglob("*")):
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+            mime_type, _ = mimetypes.guess_type(str(path))
+            corpus.append(
+                {
+                    "name": path.stem,
+                    "content_type": mime_type or "image/jpeg",
+                    "body": path.read_bytes(),
+                }
+            )
+    if not corpus:
+        raise ValueError(f"No images found in {corpus_dir}")
+    return corpus
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """線形補間によるパーセンタイル"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """Server-Timing ヘッダを {段階: ミリ秒} に変換する"""
+    stages = {}
+    for entry in (value or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, duration = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    stages[name] = float(duration)
+                except ValueError:
+                    pass
+    return stages
+
+
+class LoadGenerator:
+    """
+    ローカルの推論サーバーに一定のレートまたは並列数でリクエストを送る
+
+    rps を指定するとオープンループ（到着間隔が一定）、指定しない場合は
+    concurrency 本のクローズドループで送信する。
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        corpus: List[Dict[str, Any]],
+        output_prefix: str,
+        concurrency: int = 8,
+        rps: Optional[float] = None,
+        accept: Optional[str] = None,
+        model: Optional[str] = None,
+    ):
+        self.url = f"{endpoint}/invocations"
+        self.corpus = corpus
+        self.output_prefix = output_prefix
+        self.concurrency = max(1, concurrency)
+        self.rps = rps
+        self.accept = accept
+        self.model = model
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.concurrency, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.results: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+
+    def send(self, scheduled: Optional[float] = None) -> None:
+        """
+        1 件のリクエストを送信して結果を記録する
+
+        Args:
+            scheduled: オープンループで送信する予定だった時刻。送信が遅れた分も
+                レイテンシに含め、過負荷時の遅延を過小評価しないようにする
+        """
+        index = next(self.counter)
+        image = self.corpus[index % len(self.corpus)]
+        custom_attributes = (
+            f"output_location=s3://{self.output_prefix}/{index:06d}_{image['name']}.png"
+        )
+        if self.model:
+            custom_attributes += f";model={self.model}"
+        headers = {
+            "Content-Type": image["content_type"],
+            "X-Amzn-SageMaker-Custom-Attributes": custom_attributes,
+            "X-Amzn-SageMaker-Inference-Id": f"bench-{index:06d}",
+        }
+        if self.accept:
+            headers["X-Amzn-SageMaker-Accept"] = self.accept
+
+        start = scheduled or time.perf_counter()
+        try:
+            response = self.session.post(self.url, headers=headers, data=image["body"])
+            status = response.status_code
+            stages = parse_server_timing(response.headers.get("Server-Timing"))
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Request failed: {str(e)}")
+            status = 0
+            stages = {}
+        result = {
+            "status": status,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "stages": stages,
+        }
+        with self.lock:
+            self.results.append(result)
+
+    def run(self, duration: float, total_requests: Optional[int] = None) -> float:
+        """
+        負荷をかける
+
+        Returns:
+            float: 実行にかかった秒数
+        """
+        started = time.perf_counter()
+        deadline = started + duration
+        stop = threading.Event()
+
+        if self.rps:
+            # オープンループ: 応答を待たずに一定間隔で送信する
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                interval = 1.0 / self.rps
+                next_send = started
+                sent = 0
+                while time.perf_counter() < deadline and (
+                    total_requests is None or sent < total_requests
+                ):
+                    executor.submit(self.send, next_send)
+                    sent += 1
+                    next_send += interval
+                    time.sleep(max(0.0, next_send - time.perf_counter()))
+        else:
+            # クローズドループ: concurrency 本がそれぞれ応答を待ってから次を送る
+            remaining = itertools.count()
+
+            def worker() -> None:
+                while not stop.is_set() and time.perf_counter() < deadline:
+                    if total_requests is not None and next(remaining) >= total_requests:
+                        return
+                    self.send()
+
+            threads = [
+                threading.Thread(target=worker, daemon=True)
+                for _ in range(self.concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    thread.join()
+            except KeyboardInterrupt:
+                stop.set()
+                raise
+
+        return time.perf_counter() - started
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """レイテンシ・スループット・429 の割合・段階ごとの内訳を集計する"""
+    succeeded = [r for r in results if r["status"] == 202]
+    latencies = [r["latency_ms"] for r in succeeded]
+    status_counts: Dict[str, int] = {}
+    for r in results:
+        status_counts[str(r["status"])] = status_counts.get(str(r["status"]), 0) + 1
+
+    stage_values: Dict[str, List[float]] = {}
+    for r in succeeded:
+        for name, duration in r["stages"].items():
+            stage_values.setdefault(name, []).append(duration)
+
+    return {
+        "requests": len(results),
+        "succeeded": len(succeeded),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(succeeded) / elapsed if elapsed > 0 else 0.0,
+        "rate_429": status_counts.get("429", 0) / len(results) if results else 0.0,
+        "status_counts": status_counts,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+        },
+        "stages_ms": {
+            name: {
+                "samples": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+            for name, values in sorted(stage_values.items())
+        },
+    }
+
+
+def wait_until_ready(endpoint: str, process: subprocess.Popen, timeout: float) -> None:
+    """/ping が 200 を返すまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(f"{endpoint}/ping", timeout=2).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"Server did not become ready within {timeout} seconds")
+
+
+def start_server(
+    settings: Dict[str, str],
+    port: int,
+    log_path: Path,
+    image: str,
+    container_name: str,
+    gpus: bool = False,
+) -> subprocess.Popen:
+    """
+    ビルド済みのイメージでローカルモード（USE_AWS=false）の推論サーバーを起動する
+
+    推論サーバーの依存関係とモデルはコンテナにしかないため、ホストでは起動しない。
+    ./models を /opt/ml/model に、./local-bucket を出力先としてマウントする。
+    """
+    app_dir = Path(__file__).parent.resolve()
+    env = {
+        "USE_AWS": "false",
+        # すべてのリクエストで Server-Timing を返す
+        "TIMING_SAMPLE_RATE": "1",
+    }
+    env.update(settings)
+
+    command = ["docker", "run", "--rm", "--name", container_name, "-p", f"{port}:8080"]
+    if gpus:
+        command += ["--gpus", "all"]
+    for key, value in env.items():
+        command += ["-e", f"{key}={value}"]
+    command += [
+        "-v",
+        f"{app_dir / 'models'}:/opt/ml/model",
+        "-v",
+        f"{app_dir / 'local-bucket'}:/opt/ml/code/local-bucket",
+        image,
+    ]
+    log_file = open(log_path, "w")
+    return subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def stop_server(process: subprocess.Popen, container_name: str) -> None:
+    """推論サーバーのコンテナを停止する"""
+    subprocess.run(
+        ["docker", "stop", container_name],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def expand_matrix(matrix: List[str]) -> List[Dict[str, str]]:
+    """KEY=v1,v2 の指定を設定の直積に展開する"""
+    axes = []
+    for entry in matrix:
+        key, _, values = entry.partition("=")
+        axes.append([(key, value) for value in values.split(",")])
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def run_benchmark(args, settings: Dict[str, str]) -> Dict[str, Any]:
+    """1 つの設定でベンチマークを実行する"""
+    corpus = load_corpus(args.corpus)
+    process = None
+    endpoint = args.endpoint
+    container_name = f"rembg-benchmark-{args.port}-{int(time.time())}"
+    if args.spawn:
+        endpoint = f"http://127.0.0.1:{args.port}"
+        log_path = Path(args.output_dir) / f"server-{int(time.time())}.log"
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Starting {args.image} with {settings} (log: {log_path})")
+        process = start_server(
+            settings, args.port, log_path, args.image, container_name, args.gpus
+        )
+
+    try:
+        if process:
+            wait_until_ready(endpoint, process, args.startup_timeout)
+
+        run_id = f"bench-{int(time.time())}-{random.randint(0, 9999):04d}"
+        generator = LoadGenerator(
+            endpoint,
+            corpus,
+            output_prefix=f"{args.output_bucket}/{run_id}",
+            concurrency=args.concurrency,
+            rps=args.rps,
+            accept=args.accept,
+            model=args.model,
+        )
+
+        # ウォームアップのリクエストは集計に含めない
+        if args.warmup_requests:
+            generator.run(duration=float("inf"), total_requests=args.warmup_requests)
+            generator.results = []
+
+        elapsed = generator.run(args.duration, args.requests)
+        summary = summarize(generator.results, elapsed)
+    finally:
+        if process:
+            stop_server(process, container_name)
+
+    return {
+        "run_id": run_id,
+        "settings": settings,
+        "load": {
+            "rps": args.rps,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "model": args.model,
+            "accept": args.accept,
+            "corpus": args.corpus,
+            "corpus_size": len(corpus),
+        },
+        "summary": summary,
+    }
+
+
+def format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_report(runs: List[Dict[str, Any]]) -> None:
+    """実行結果を表形式で表示する"""
+    print(
+        f"{'settings':<48} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'429%':>6}"
+    )
+    for run in runs:
+        summary = run["summary"]
+        label = ",".join(f"{k}={v}" for k, v in run["settings"].items()) or "-"
+        print(
+            f"{label:<48} {summary['throughput_rps']:>8.2f} "
+            f"{format_ms(summary['latency_ms']['p50']):>8} "
+            f"{format_ms(summary['latency_ms']['p95']):>8} "
+            f"{format_ms(summary['latency_ms']['p99']):>8} "
+            f"{summary['rate_429'] * 100:>6.1f}"
+        )
+        for name, stage in summary["stages_ms"].items():
+            print(
+                f"  {name:<46} {'':>8} {format_ms(stage['p50']):>8} "
+                f"{format_ms(stage['p95']):>8} {format_ms(stage['p99']):>8}"
+            )
+
+
+def compare(paths: List[str]) -> None:
+    """保存した結果ファイルを並べて表示する"""
+    runs = []
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        for run in data["runs"]:
+            run = dict(run)
+            run["settings"] = {"file": Path(path).name, **run["settings"]}
+            runs.append(run)
+    print_report(runs)
+
+
+def main() -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="ローカルの推論サーバー（USE_AWS=false）に負荷をかけて性能を計測する"
+    )
+    parser.add_argument(
+        "--corpus",
+        default="local-bucket/examples",
+        help="リクエストに使う画像のディレクトリ（デフォルト: local-bucket/examples）",
+    )
+    parser.add_argument(
+        "--endpoint",
+        default=f"http://{os.getenv('LOCAL_ENDPOINT_HOST', 'localhost:8080')}",
+        help="起動済みサーバーの URL（--spawn を指定しない場合）",
+    )
+    parser.add_argument(
+        "--output-bucket",
+        default="local-bucket/benchmark",
+        help="出力先（ローカルモードのサーバーから見たパス）",
+    )
+    parser.add_argument("--rps", type=float, help="1 秒あたりのリクエスト数（オープンループ）")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="並列数（デフォルト: 8）"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60.0, help="計測時間（秒、デフォルト: 60）"
+    )
+    parser.add_argument("--requests", type=int, help="送信するリクエスト数の上限")
+    parser.add_argument(
+        "--warmup-requests",
+        type=int,
+        default=0,
+        help="計測前に送って集計から除くリクエスト数",
+    )
+    parser.add_argument("--model", help="カスタム属性 model= で指定するモデル")
+    parser.add_argument("--accept", help="Accept（例: image/webp）")
+    parser.add_argument(
+        "--spawn",
+        action="store_true",
+        help="設定ごとに推論サーバーのコンテナを起動して計測する",
+    )
+    parser.add_argument(
+        "--image",
+        default="rembg-async-app:cpu",
+        help="--spawn で起動するイメージ（デフォルト: rembg-async-app:cpu）",
+    )
+    parser.add_argument(
+        "--gpus", action="store_true", help="--spawn のコンテナで GPU を使う"
+    )
+    parser.add_argument(
+        "--matrix",
+        action="append",
+        default=[],
+        help="--spawn で試す環境変数（例: MAX_CONCURRENT_INVOCATIONS=1,2,4）。複数指定で直積",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8081, help="--spawn で起動するサーバーのポート"
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=300.0,
+        help="サーバーの起動を待つ最大秒数",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="benchmark-results",
+        help="結果とサーバーログの保存先（デフォルト: benchmark-results）",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="RESULT_JSON",
+        help="保存した結果ファイルを比較表示する",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return 0
+
+    if args.matrix and not args.spawn:
+        parser.error("--matrix requires --spawn")
+
+    runs = []
+    for settings in expand_matrix(args.matrix) if args.matrix else [{}]:
+        run = run_benchmark(args, settings)
+        runs.append(run)
+        print_report([run])
+
+    output_path = Path(args.output_dir) / f"benchmark-{int(time.time())}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({"runs": runs}, f, indent=2)
+    logger.info(f"Results saved to {output_path}")
+
+    if len(runs) > 1:
+        print_report(runs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,28 @@
+import asyncio
+import json
 import logging
+import sys
+import time
+from typing import Callable, Optional
+
 import boto3
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# EMF lines are written to stdout as bare JSON, without the log record format
+emf_logger = logging.getLogger(f"{__name__}.emf")
+emf_logger.setLevel(logging.INFO)
+emf_logger.propagate = False
+if not emf_logger.handlers:
+    _emf_handler = logging.StreamHandler(sys.stdout)
+    _emf_handler.setFormatter(logging.Formatter("%(message)s"))
+    emf_logger.addHandler(_emf_handler)
+
+# PutMetricData accepts at most this many datums per call
+MAX_DATUMS_PER_CALL = 1000
+
 
 class CloudWatchMetricsHandler:
     """Handler for CloudWatch metrics operations"""
@@ -13,21 +31,145 @@ class CloudWatchMetricsHandler:
         self.namespace = namespace
         self.cloudwatch = boto3.client("cloudwatch")
 
-    def put_backlog_metric(self, endpoint_name: str, backlog_size: int) -> None:
-        """Update CloudWatch metrics for queue monitoring"""
-        try:
-            self.cloudwatch.put_metric_data(
-                Namespace=self.namespace,
-                MetricData=[
+    def put_metric_data(self, metric_data: list) -> None:
+        """Send metric datums, splitting them into calls of the maximum allowed size"""
+        for start in range(0, len(metric_data), MAX_DATUMS_PER_CALL):
+            try:
+                self.cloudwatch.put_metric_data(
+                    Namespace=self.namespace,
+                    MetricData=metric_data[start : start + MAX_DATUMS_PER_CALL],
+                )
+            except Exception as e:
+                logger.error(f"Error updating metrics: {str(e)}")
+
+    def emit_emf(self, endpoint_name: str, metric_data: list) -> None:
+        """Write datums as CloudWatch embedded metric format log lines to stdout"""
+        for datum in metric_data:
+            stats = datum["StatisticValues"]
+            emf_logger.info(
+                json.dumps(
                     {
-                        "MetricName": "ApproximateBacklogSizePerInstance",
-                        "Value": backlog_size,
-                        "Unit": "Count",
-                        "Dimensions": [
-                            {"Name": "EndpointName", "Value": endpoint_name}
-                        ],
+                        "_aws": {
+                            "Timestamp": int(datum["Timestamp"] * 1000),
+                            "CloudWatchMetrics": [
+                                {
+                                    "Namespace": self.namespace,
+                                    "Dimensions": [["EndpointName"]],
+                                    "Metrics": [
+                                        {
+                                            "Name": datum["MetricName"],
+                                            "Unit": datum["Unit"],
+                                        }
+                                    ],
+                                }
+                            ],
+                        },
+                        "EndpointName": endpoint_name,
+                        datum["MetricName"]: stats["Sum"] / stats["SampleCount"],
                     }
-                ],
+                )
+            )
+
+
+class MetricsAggregator:
+    """Samples gauges in the background and publishes them in batches
+
+    ``sampler`` is called every ``sample_interval`` seconds on the event loop
+    and returns ``{metric name: value}``. Samples are folded into one
+    statistic set per metric and flushed every ``flush_interval`` seconds,
+    from a worker thread, either with PutMetricData (``mode="cloudwatch"``) or
+    as EMF log lines on stdout (``mode="emf"``), so neither the request path
+    nor the event loop waits on CloudWatch or on stdout.
+    """
+
+    def __init__(
+        self,
+        handler: CloudWatchMetricsHandler,
+        endpoint_name: str,
+        sampler: Callable[[], dict],
+        units: Optional[dict] = None,
+        sample_interval: float = 5.0,
+        flush_interval: float = 60.0,
+        mode: str = "cloudwatch",
+    ):
+        self.handler = handler
+        self.endpoint_name = endpoint_name
+        self.sampler = sampler
+        self.units = units or {}
+        self.sample_interval = sample_interval
+        self.flush_interval = flush_interval
+        self.mode = mode
+        self._stats: dict = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start sampling on the running event loop"""
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Metrics aggregator started: mode={self.mode}, "
+            f"sample_interval={self.sample_interval}s, flush_interval={self.flush_interval}s"
+        )
+
+    async def stop(self) -> None:
+        """Stop sampling and flush what has been collected"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def sample(self) -> None:
+        """Record one sample of every gauge"""
+        for name, value in self.sampler().items():
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = {
+                    "SampleCount": 1,
+                    "Sum": value,
+                    "Minimum": value,
+                    "Maximum": value,
+                }
+            else:
+                stats["SampleCount"] += 1
+                stats["Sum"] += value
+                stats["Minimum"] = min(stats["Minimum"], value)
+                stats["Maximum"] = max(stats["Maximum"], value)
+
+    async def flush(self) -> None:
+        """Publish the collected statistic sets"""
+        if not self._stats:
+            return
+        stats, self._stats = self._stats, {}
+        timestamp = time.time()
+        metric_data = [
+            {
+                "MetricName": name,
+                "Timestamp": timestamp,
+                "StatisticValues": values,
+                "Unit": self.units.get(name, "Count"),
+                "Dimensions": [{"Name": "EndpointName", "Value": self.endpoint_name}],
+            }
+            for name, values in stats.items()
+        ]
+        if self.mode == "emf":
+            await asyncio.to_thread(
+                self.handler.emit_emf, self.endpoint_name, metric_data
             )
-        except Exception as e:
-            logger.error(f"Error updating metrics: {str(e)}")
+        else:
+            await asyncio.to_thread(self.handler.put_metric_data, metric_data)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + self.flush_interval
+        while True:
+            await asyncio.sleep(self.sample_interval)
+            try:
+                self.sample()
+                if loop.time() >= next_flush:
+                    next_flush = loop.time() + self.flush_interval
+                    await self.flush()
+            except Exception as e:
+                logger.error(f"Error publishing metrics: {str(e)}")
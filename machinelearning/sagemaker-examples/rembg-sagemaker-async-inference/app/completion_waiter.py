@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import boto3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from botocore.config import Config
+
+# ロガーの設定
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# 待機を終えた InferenceId を覚えておく件数の上限（重複・遅延した通知の削除に使う）
+MAX_FINISHED_IDS = 10000
+
+
+def parse_notification(body: str) -> Optional[Dict[str, Any]]:
+    """
+    SQS メッセージ本文から非同期推論の完了通知を取り出す
+
+    SNS のエンベロープ付き（通常の配信）と raw message delivery の両方に対応する。
+
+    Returns:
+        Optional[Dict[str, Any]]: {
+            'InferenceId': string,
+            'Status': 'Completed' | 'Failed',
+            'OutputLocation': string (optional),
+            'FailureReason': string (optional)
+        }
+    """
+    try:
+        message = json.loads(body)
+        if message.get("Type") == "Notification" and "Message" in message:
+            message = json.loads(message["Message"])
+    except (TypeError, ValueError):
+        return None
+
+    inference_id = message.get("inferenceId")
+    if not inference_id:
+        return None
+
+    response_parameters = message.get("responseParameters") or {}
+    return {
+        "InferenceId": inference_id,
+        "Status": message.get("invocationStatus", "Failed"),
+        "OutputLocation": response_parameters.get("outputLocation"),
+        "FailureReason": message.get("failureReason"),
+    }
+
+
+class CompletionWaiter:
+    """
+    非同期推論の完了を待機する
+
+    エンドポイントの成功・エラー通知の SNS トピックを購読する SQS キューを
+    バックグラウンドスレッドで受信し、InferenceId ごとの待機者に振り分ける。
+    キューが設定されていない場合と、通知が notification_grace_period 秒待っても
+    届かない場合だけ、出力ファイルを head_object で間隔を広げながら確認する。
+
+    キューは複数のクライアントで共有できる。削除するのはこの待機者が登録した
+    InferenceId の通知だけで、他のクライアントの通知や登録前に届いた通知は
+    可視性タイムアウトを 0 にしてキューに戻す（登録後に再び受信する）。
+    """
+
+    def __init__(
+        self,
+        queue_url: Optional[str] = None,
+        s3_client: Any = None,
+        sqs_endpoint_url: Optional[str] = None,
+        sqs_client: Any = None,
+        initial_poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+        notification_grace_period: float = 300.0,
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.queue_url = queue_url or os.getenv("NOTIFICATION_QUEUE_URL") or None
+        self.s3 = s3_client or boto3.client("s3")
+        # ローカルの SQS 互換サーバーでテストする場合は SQS_ENDPOINT_URL を指定する
+        if not self.queue_url:
+            self.sqs = None
+        elif sqs_client is not None:
+            self.sqs = sqs_client
+        else:
+            self.sqs = boto3.client(
+                "sqs",
+                endpoint_url=sqs_endpoint_url or os.getenv("SQS_ENDPOINT_URL") or None,
+                config=Config(retries={"mode": "adaptive"}),
+            )
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.notification_grace_period = notification_grace_period
+
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Dict[str, Any]] = {}
+        self._finished: OrderedDict = OrderedDict()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def uses_notifications(self) -> bool:
+        return self.sqs is not None
+
+    def start(self) -> "CompletionWaiter":
+        """通知の受信を開始する"""
+        if self.uses_notifications and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._receive_loop, name="completion-waiter", daemon=True
+            )
+            self._thread.start()
+            self.logger.info(f"Listening for notifications on {self.queue_url}")
+        return self
+
+    def stop(self, wait: bool = False) -> None:
+        """
+        通知の受信を停止する
+
+        Args:
+            wait: 実行中のロングポーリング（最大 20 秒）の終了を待つかどうか
+        """
+        self._stop.set()
+        if self._thread:
+            if wait:
+                self._thread.join()
+            self._thread = None
+
+    def register(
+        self,
+        inference_id: str,
+        callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        """
+        推論リクエストの送信前に待機者を登録する
+
+        登録した InferenceId の通知だけがキューから削除される。
+
+        Args:
+            inference_id: 推論リクエストの InferenceId
+            callback: 通知を受け取ったときに受信スレッドから呼ばれる関数
+        """
+        with self._lock:
+            waiter = {"event": threading.Event(), "result": None, "callback": callback}
+            self._waiters[inference_id] = waiter
+
+    def wait(
+        self,
+        inference_id: str,
+        output_bucket: Optional[str] = None,
+        output_key: Optional[str] = None,
+        timeout: float = 60.0,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        推論の完了を待機する
+
+        通知を受信している場合は通知だけを待ち、notification_grace_period 秒を過ぎても
+        届かなければ、出力先が指定されていれば head_object でも確認する。キューが
+        設定されていない場合は最初から head_object で確認する。確認の間隔は
+        initial_poll_interval から max_poll_interval まで倍々に広げる。
+
+        Returns:
+            Optional[Dict[str, Any]]: 完了通知（parse_notification の形式）、期限切れの場合は None
+        """
+        with self._lock:
+            waiter = self._waiters.get(inference_id)
+        if waiter is None:
+            self.register(inference_id)
+            with self._lock:
+                waiter = self._waiters[inference_id]
+
+        deadline = time.monotonic() + timeout
+        polling_starts = time.monotonic()
+        if self.uses_notifications:
+            polling_starts += self.notification_grace_period
+        interval = self.initial_poll_interval
+        try:
+            while True:
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0:
+                    return None
+                if now < polling_starts:
+                    if waiter["event"].wait(min(polling_starts - now, remaining)):
+                        return waiter["result"]
+                    continue
+                if waiter["event"].wait(min(interval, remaining)):
+                    return waiter["result"]
+                if output_bucket and output_key and self._output_exists(
+                    output_bucket, output_key
+                ):
+                    return {
+                        "InferenceId": inference_id,
+                        "Status": "Completed",
+                        "OutputLocation": f"s3://{output_bucket}/{output_key}",
+                        "FailureReason": None,
+                    }
+                interval = min(interval * 2, self.max_poll_interval)
+        finally:
+            with self._lock:
+                if self._waiters.pop(inference_id, None) is not None:
+                    self._finish(inference_id)
+
+    def _output_exists(self, output_bucket: str, output_key: str) -> bool:
+        try:
+            self.s3.head_object(Bucket=output_bucket, Key=output_key)
+            return True
+        except self.s3.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] == "404":
+                return False
+            raise
+
+    def _dispatch(self, result: Dict[str, Any]) -> bool:
+        """
+        通知を InferenceId の待機者に渡す
+
+        Returns:
+            bool: この待機者宛ての通知（キューから削除してよい）かどうか
+        """
+        inference_id = result["InferenceId"]
+        with self._lock:
+            waiter = self._waiters.get(inference_id)
+            if waiter is None:
+                # 待機を終えた推論の重複・遅延した通知だけを削除する
+                return inference_id in self._finished
+            if waiter["event"].is_set():
+                return True
+            if waiter["callback"]:
+                # コールバックで受け取る待機者は wait を呼ばないので、ここで登録を外す
+                del self._waiters[inference_id]
+                self._finish(inference_id)
+        self._resolve(waiter, result)
+        return True
+
+    def _finish(self, inference_id: str) -> None:
+        # 呼び出し元が _lock を保持していること
+        self._finished[inference_id] = True
+        while len(self._finished) > MAX_FINISHED_IDS:
+            self._finished.popitem(last=False)
+
+    def _resolve(self, waiter: Dict[str, Any], result: Dict[str, Any]) -> None:
+        waiter["result"] = result
+        waiter["event"].set()
+        if waiter["callback"]:
+            try:
+                waiter["callback"](result)
+            except Exception as e:
+                self.logger.error(f"Error in completion callback: {str(e)}")
+
+    def _receive_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                response = self.sqs.receive_message(
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=10,
+                    WaitTimeSeconds=20,
+                )
+            except Exception as e:
+                self.logger.error(f"Error receiving notifications: {str(e)}")
+                self._stop.wait(self.initial_poll_interval)
+                continue
+
+            claimed = []
+            released = []
+            for message in response.get("Messages", []):
+                result = parse_notification(message.get("Body", ""))
+                if result and self._dispatch(result):
+                    claimed.append(message)
+                else:
+                    released.append(message)
+
+            if claimed:
+                try:
+                    self.sqs.delete_message_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=[
+                            {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]}
+                            for i, m in enumerate(claimed)
+                        ],
+                    )
+                except Exception as e:
+                    self.logger.error(f"Error deleting notifications: {str(e)}")
+            if released:
+                # 他のクライアント宛ての通知と登録前に届いた通知は、すぐに受信できるよう戻す
+                try:
+                    self.sqs.change_message_visibility_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=[
+                            {
+                                "Id": str(i),
+                                "ReceiptHandle": m["ReceiptHandle"],
+                                "VisibilityTimeout": 0,
+                            }
+                            for i, m in enumerate(released)
+                        ],
+                    )
+                except Exception as e:
+                    self.logger.error(f"Error releasing notifications: {str(e)}")
+                if not claimed:
+                    # 戻した通知だけを受信し続けないよう、次の受信まで少し待つ
+                    self._stop.wait(self.initial_poll_interval)
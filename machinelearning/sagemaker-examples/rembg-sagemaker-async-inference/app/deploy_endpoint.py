@@ -83,16 +83,20 @@ def deploy_async_endpoint(
         env={
             "CUDA_ENABLED": "1" if use_gpu else "0",
             "MODEL_NAME": os.getenv("MODEL_NAME", "u2net"),
+            "AVAILABLE_MODELS": os.getenv(
+                "AVAILABLE_MODELS", os.getenv("MODEL_NAME", "u2net")
+            ),
             "MODEL_PATH": "/opt/ml/model",  # SageMaker default model path
         },
     )
 
     # Configure async inference
+    max_concurrent_invocations = int(os.getenv("MAX_CONCURRENT_INVOCATIONS", "4"))
     async_config = AsyncInferenceConfig(
         output_path=f"s3://{output_bucket}/async-inference-output",
-        max_concurrent_invocations_per_instance=int(
-            os.getenv("MAX_CONCURRENT_INVOCATIONS", "4")
-        ),
+        # Clients detect failed requests by the FailureLocation under this path
+        failure_path=f"s3://{output_bucket}/async-inference-failures",
+        max_concurrent_invocations_per_instance=max_concurrent_invocations,
         notification_config={
             "SuccessTopic": os.getenv("SUCCESS_TOPIC_ARN"),
             "ErrorTopic": os.getenv("ERROR_TOPIC_ARN"),
@@ -112,31 +116,96 @@ def deploy_async_endpoint(
     client = boto3.client("application-autoscaling")
 
     # Register scalable target
+    resource_id = f"endpoint/{endpoint_name}/variant/AllTraffic"
     client.register_scalable_target(
         ServiceNamespace="sagemaker",
-        ResourceId=f"endpoint/{endpoint_name}/variant/AllTraffic",
+        ResourceId=resource_id,
         ScalableDimension="sagemaker:variant:DesiredInstanceCount",
         MinCapacity=0,
-        MaxCapacity=2,
+        MaxCapacity=int(os.getenv("MAX_INSTANCE_COUNT", "2")),
     )
 
-    # Configure scaling policy
+    # Track the backlog per instance instead of the invocation rate.
+    # "container" (the default) uses the EWMA-smoothed queued plus in-flight
+    # work published by inference.py, "sagemaker" the endpoint's own queue
+    # (AWS/SageMaker).
+    if os.getenv("SCALING_METRIC", "container").lower() == "sagemaker":
+        backlog_namespace = "AWS/SageMaker"
+        default_target = 4.0
+    else:
+        backlog_namespace = "CustomMetrics/AsyncInference"
+        # SageMaker sends at most MaxConcurrentInvocationsPerInstance requests to
+        # a container, so its backlog never exceeds that. The target must stay
+        # below it, or the policy can never scale out.
+        default_target = max(1.0, 0.75 * max_concurrent_invocations)
+    backlog_target = float(
+        os.getenv("BACKLOG_TARGET_PER_INSTANCE", str(default_target))
+    )
+    if (
+        backlog_namespace != "AWS/SageMaker"
+        and backlog_target >= max_concurrent_invocations
+    ):
+        print(
+            f"Warning: BACKLOG_TARGET_PER_INSTANCE ({backlog_target}) is not below "
+            f"MAX_CONCURRENT_INVOCATIONS ({max_concurrent_invocations}); "
+            "the container backlog cannot exceed it, so the endpoint will not "
+            "scale out"
+        )
     client.put_scaling_policy(
         PolicyName=f"{endpoint_name}-scaling-policy",
         ServiceNamespace="sagemaker",
-        ResourceId=f"endpoint/{endpoint_name}/variant/AllTraffic",
+        ResourceId=resource_id,
         ScalableDimension="sagemaker:variant:DesiredInstanceCount",
         PolicyType="TargetTrackingScaling",
         TargetTrackingScalingPolicyConfiguration={
-            "TargetValue": 70.0,  # Target utilization of 70%
-            "PredefinedMetricSpecification": {
-                "PredefinedMetricType": "SageMakerVariantInvocationsPerInstance"
+            # Requests waiting per instance
+            "TargetValue": backlog_target,
+            "CustomizedMetricSpecification": {
+                "MetricName": "ApproximateBacklogSizePerInstance",
+                "Namespace": backlog_namespace,
+                "Dimensions": [{"Name": "EndpointName", "Value": endpoint_name}],
+                "Statistic": "Average",
             },
-            "ScaleOutCooldown": 300,  # 5 minutes
+            "ScaleOutCooldown": 60,  # 1 minute
             "ScaleInCooldown": 300,  # 5 minutes
         },
     )
 
+    # Target tracking cannot scale out from zero instances, because no
+    # instance reports a backlog. Step scaling on HasBacklogWithoutCapacity
+    # starts the first instance.
+    step_policy = client.put_scaling_policy(
+        PolicyName=f"{endpoint_name}-scale-from-zero",
+        ServiceNamespace="sagemaker",
+        ResourceId=resource_id,
+        ScalableDimension="sagemaker:variant:DesiredInstanceCount",
+        PolicyType="StepScaling",
+        StepScalingPolicyConfiguration={
+            "AdjustmentType": "ChangeInCapacity",
+            "MetricAggregationType": "Average",
+            "Cooldown": 300,  # 5 minutes
+            "StepAdjustments": [
+                {"MetricIntervalLowerBound": 0, "ScalingAdjustment": 1}
+            ],
+        },
+    )
+
+    cloudwatch = boto3.client("cloudwatch")
+    cloudwatch.put_metric_alarm(
+        AlarmName=f"{endpoint_name}-has-backlog-without-capacity",
+        MetricName="HasBacklogWithoutCapacity",
+        Namespace="AWS/SageMaker",
+        Statistic="Average",
+        Dimensions=[{"Name": "EndpointName", "Value": endpoint_name}],
+        Period=60,
+        EvaluationPeriods=2,
+        DatapointsToAlarm=2,
+        Threshold=1,
+        ComparisonOperator="GreaterThanOrEqualToThreshold",
+        TreatMissingData="missing",
+        AlarmActions=[step_policy["PolicyARN"]],
+    )
+
     print(f"Endpoint {endpoint_name} deployed successfully")
     return predictor
 
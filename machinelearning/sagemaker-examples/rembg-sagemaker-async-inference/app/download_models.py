@@ -1,16 +1,21 @@
 import os
+import shutil
+import hashlib
+import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
 # Set the models directory
 models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
 
-# Create models directory if it doesn't exist
-os.makedirs(models_dir, exist_ok=True)
-
 # Define base URL
 BASE_URL = "https://github.com/danielgatis/rembg/releases/download/v0.0.0/"
 
+# Read and write in large chunks instead of the requests default
+CHUNK_SIZE = 1024 * 1024
+
 # Define models and their filenames, please check models you need
 MODELS = {
     "u2net": "u2net.onnx",
@@ -31,48 +36,170 @@ MODELS = {
     # "birefnet-massive": "BiRefNet-massive-TR_DIS5K_TR_TEs-epoch_420.onnx"
 }
 
+# Known MD5 checksums of the release files, as published by rembg
+CHECKSUMS = {
+    "u2net.onnx": "60024c5c889badc19c04ad937298a77b",
+    "isnet-general-use.onnx": "fc16ebd8b0c10d971d3513d564d01e29",
+    "BiRefNet-general-epoch_244.onnx": "7a35a0141cbbc80de11d9c9a28f52697",
+}
+
 
-def download_file(url, filepath):
+def file_digests(filepath):
     """
-    Download a file with progress bar
+    Return the (MD5, SHA-256) hex digests of a file
     """
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    total_size = int(response.headers.get("content-length", 0))
-
-    with (
-        open(filepath, "wb") as f,
-        tqdm(
-            desc=os.path.basename(filepath),
-            total=total_size,
-            unit="iB",
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as pbar,
-    ):
-        for data in response.iter_content(chunk_size=1024):
-            size = f.write(data)
-            pbar.update(size)
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            md5.update(chunk)
+            sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
 
 
-def main():
-    print("Starting model downloads...")
+def download_file(session, url, filepath, retries=3):
+    """
+    Download a file with progress bar, resuming a partial file with HTTP range requests
+    """
+    for attempt in range(1, retries + 1):
+        offset = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            response = session.get(url, headers=headers, stream=True, timeout=60)
+            with response:
+                if response.status_code == 416:
+                    # The partial file already holds the whole content
+                    return
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # The server ignored the range, start over
+                    offset = 0
+                total_size = offset + int(response.headers.get("content-length", 0))
 
-    for model_name, filename in MODELS.items():
-        output_filename = f"{model_name}.onnx"
-        output_path = os.path.join(models_dir, output_filename)
+                with (
+                    open(filepath, "ab" if offset else "wb") as f,
+                    tqdm(
+                        desc=os.path.basename(filepath),
+                        total=total_size,
+                        initial=offset,
+                        unit="iB",
+                        unit_scale=True,
+                        unit_divisor=1024,
+                    ) as pbar,
+                ):
+                    for data in response.iter_content(chunk_size=CHUNK_SIZE):
+                        size = f.write(data)
+                        pbar.update(size)
 
-        if os.path.exists(output_path):
-            print(f"Model {output_filename} already exists, skipping...")
-            continue
+            size = os.path.getsize(filepath)
+            if total_size and size != total_size:
+                raise IOError(f"Incomplete download: {size} of {total_size} bytes")
+            return
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries:
+                raise
+            print(f"Retrying {os.path.basename(filepath)} ({attempt}/{retries}): {e}")
+
+
+def verify_and_install(model_name, filename, part_path, output_path):
+    """
+    Verify a downloaded file, write its SHA-256 sidecar and move it into place
+    """
+    md5, sha256 = file_digests(part_path)
+    expected = CHECKSUMS.get(filename)
+    if expected and md5 != expected:
+        os.remove(part_path)
+        raise ValueError(
+            f"Checksum mismatch for {model_name}: expected {expected}, got {md5}"
+        )
+
+    # The inference server verifies the model against this file before loading it
+    with open(output_path + ".sha256", "w") as f:
+        f.write(f"{sha256}  {os.path.basename(output_path)}\n")
+    os.replace(part_path, output_path)
 
-        url = BASE_URL + filename
-        print(f"\nDownloading {model_name}...")
+
+def fetch_model(session, model_name, filename, mirror_dir=None, retries=3):
+    """
+    Put one model into the models directory, from the mirror if it has it
+    """
+    output_filename = f"{model_name}.onnx"
+    output_path = os.path.join(models_dir, output_filename)
+    part_path = output_path + ".part"
+
+    if os.path.exists(output_path):
+        if os.path.exists(output_path + ".sha256"):
+            print(f"Model {output_filename} already exists, skipping...")
+            return
+        # Files from older runs were not verified, so check them now
+        os.replace(output_path, part_path)
         try:
-            download_file(url, output_path)
-            print(f"Successfully downloaded {model_name}")
-        except Exception as e:
-            print(f"Error downloading {model_name}: {str(e)}")
+            verify_and_install(model_name, filename, part_path, output_path)
+            print(f"Model {output_filename} already exists, verified")
+            return
+        except ValueError as e:
+            print(f"{e}, downloading again")
+
+    mirror_path = next(
+        (
+            os.path.join(mirror_dir, name)
+            for name in (filename, output_filename)
+            if mirror_dir and os.path.exists(os.path.join(mirror_dir, name))
+        ),
+        None,
+    )
+    if mirror_path:
+        print(f"Copying {model_name} from {mirror_path}...")
+        shutil.copyfile(mirror_path, part_path)
+    else:
+        print(f"Downloading {model_name}...")
+        download_file(session, BASE_URL + filename, part_path, retries)
+
+    verify_and_install(model_name, filename, part_path, output_path)
+    print(f"Successfully downloaded {model_name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download rembg models")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Number of parallel downloads"
+    )
+    parser.add_argument(
+        "--mirror",
+        default=os.environ.get("MODEL_MIRROR_DIR"),
+        help="Local directory to copy models from before downloading them",
+    )
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per download")
+    args = parser.parse_args()
+
+    # Create models directory if it doesn't exist
+    os.makedirs(models_dir, exist_ok=True)
+
+    print("Starting model downloads...")
+    failed = []
+    with requests.Session() as session:
+        session.mount("https://", HTTPAdapter(pool_maxsize=max(1, args.workers)))
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            futures = {
+                executor.submit(
+                    fetch_model,
+                    session,
+                    model_name,
+                    filename,
+                    args.mirror,
+                    args.retries,
+                ): model_name
+                for model_name, filename in MODELS.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(futures[future])
+                    print(f"Error downloading {futures[future]}: {str(e)}")
+
+    if failed:
+        raise SystemExit(f"Failed to download: {', '.join(sorted(failed))}")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,33 @@
 import os
 import io
+import math
 import logging
 import asyncio
+import signal
 import time
+from contextlib import asynccontextmanager
 from typing import Optional
 from concurrent.futures import ThreadPoolExecutor
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 
-from inference_processor import LocalInferenceProcessor, AWSInferenceProcessor
+from inference_processor import (
+    LocalInferenceProcessor,
+    AWSInferenceProcessor,
+    parse_image_sizes,
+)
+from output_encoder import OutputEncoder
+from session_registry import configured_models
+from backlog_estimator import BacklogEstimator
+from cloudwatch_metrics import MetricsAggregator
+from micro_batcher import MicroBatcher
+from process_pool import ProcessPoolInference
+from result_cache import ResultCache, cache_key
+from stage_timing import RequestTiming, StageMetrics
+from work_queue import AdmissionQueue, DeadlineExceededError, QueueFullError
 
 from dotenv import load_dotenv
 
@@ -24,8 +40,82 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
+
+def log_model_directory() -> None:
+    """Log the contents of the model directory once at startup"""
+    if not os.path.exists(model_dir_path):
+        logger.warning(f"{model_dir_path} does not exist")
+        return
+    logger.info(f"Contents of {model_dir_path}:")
+    for root, dirs, files in os.walk(model_dir_path):
+        logger.info(f"Directory: {root}")
+        if dirs:
+            logger.info(f"Subdirectories: {dirs}")
+        if files:
+            logger.info(f"Files: {files}")
+
+
+async def warm_up() -> None:
+    """Start and warm up the inference backend, then mark the server ready
+
+    /ping reports unhealthy until this completes, so SageMaker does not route
+    traffic to an instance whose models are still loading or cold. A failed
+    warm-up run is not fatal, since models also load on the first request, but
+    the process exits if the worker processes cannot start, so that the
+    instance is replaced instead of reporting unhealthy forever.
+    """
+    start = time.perf_counter()
+    timings = {}
+    if process_pool:
+        try:
+            worker_timings = await asyncio.to_thread(process_pool.start)
+        except Exception as e:
+            logger.critical(
+                f"Failed to start the inference worker processes: {str(e)}",
+                exc_info=True,
+            )
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        for pid, runs in worker_timings.items():
+            timings.update({f"{pid}/{run}": t for run, t in runs.items()})
+    elif warmup_image_sizes:
+        try:
+            timings = await asyncio.get_running_loop().run_in_executor(
+                thread_pool, processor.warm_up, warmup_image_sizes, max_batch_size
+            )
+        except Exception as e:
+            logger.error(f"Warm-up failed, serving without it: {str(e)}", exc_info=True)
+
+    for seconds in timings.values():
+        stage_metrics.observe("warmup", seconds)
+    warmup_timings.update(timings)
+    inference_ready.set()
+    logger.info(
+        f"Warm-up completed in {time.perf_counter() - start:.3f}s "
+        f"({len(timings)} runs)"
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_model_directory()
+    warmup_task = asyncio.create_task(warm_up())
+    batcher.start()
+    work_queue.start()
+    if metrics_aggregator:
+        metrics_aggregator.start()
+    yield
+    warmup_task.cancel()
+    if metrics_aggregator:
+        await metrics_aggregator.stop()
+    await work_queue.stop()
+    await batcher.stop()
+    if process_pool:
+        process_pool.shutdown()
+
+
 # Initialize the FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 @app.exception_handler(RequestValidationError)
@@ -76,83 +166,323 @@ class SageMakerHeaders(BaseModel):
 # Initialize configuration
 USE_AWS = os.environ.get("USE_AWS", "true").lower() == "true"
 model_name = os.environ.get("MODEL_NAME", "u2net")
+available_models = configured_models()
 max_concurrent_invocations = int(os.environ.get("MAX_CONCURRENT_INVOCATIONS", "2"))
 model_dir_path = os.environ.get("MODEL_PATH", "/opt/ml/model")
-semaphore = asyncio.Semaphore(max_concurrent_invocations)
+max_batch_size = int(os.environ.get("MAX_BATCH_SIZE", "4"))
+max_batch_wait_ms = float(os.environ.get("MAX_BATCH_WAIT_MS", "10"))
+max_queue_depth = int(os.environ.get("MAX_QUEUE_DEPTH", "16"))
+max_pending_uploads = int(
+    os.environ.get("MAX_PENDING_UPLOADS", str(2 * max_concurrent_invocations))
+)
+default_invocation_timeout = float(os.environ.get("INVOCATION_TIMEOUT_SECONDS", "900"))
+# "thread" runs inference in this process, "process" in a pool of worker processes
+inference_worker_mode = os.environ.get("INFERENCE_WORKER_MODE", "thread").lower()
+use_process_pool = inference_worker_mode == "process"
+# Fraction of requests whose stage timings are recorded and returned
+timing_sample_rate = float(os.environ.get("TIMING_SAMPLE_RATE", "0.1"))
+stage_metrics = StageMetrics()
+# Synthetic image sizes run through every model before /ping reports healthy
+warmup_image_sizes = parse_image_sizes(
+    os.environ.get("WARMUP_IMAGE_SIZES", "640x480,1920x1080")
+)
+warmup_timings: dict = {}
+inference_ready = asyncio.Event()
 thread_pool = ThreadPoolExecutor(max_workers=max_concurrent_invocations)
+upload_slots = asyncio.Semaphore(max_pending_uploads)
 
 # Initialize processor based on environment
 processor = (
-    AWSInferenceProcessor(model_name)
+    AWSInferenceProcessor(model_name, load_model=not use_process_pool)
     if USE_AWS
-    else LocalInferenceProcessor(model_name)
+    else LocalInferenceProcessor(model_name, load_model=not use_process_pool)
+)
+
+# In process mode each worker process owns its own model session
+process_pool = (
+    ProcessPoolInference(
+        model_name,
+        num_workers=max_concurrent_invocations,
+        warmup_sizes=warmup_image_sizes,
+        warmup_batch_size=max_batch_size,
+    )
+    if use_process_pool
+    else None
+)
+inference_backend = process_pool or processor
+
+# Outputs of repeated inputs are served from the cache instead of running inference
+result_cache_memory_mb = float(os.environ.get("RESULT_CACHE_MEMORY_MB", "256"))
+result_cache_dir = os.environ.get("RESULT_CACHE_DIR")
+result_cache_disk_mb = float(os.environ.get("RESULT_CACHE_DISK_MB", "1024"))
+result_cache_s3_location = (
+    os.environ.get("RESULT_CACHE_S3_LOCATION") if USE_AWS else None
+)
+result_cache = (
+    ResultCache(
+        int(result_cache_memory_mb * 1024 * 1024),
+        disk_dir=result_cache_dir,
+        max_disk_bytes=int(result_cache_disk_mb * 1024 * 1024),
+        s3_client=processor.s3 if result_cache_s3_location else None,
+        s3_location=result_cache_s3_location,
+    )
+    if result_cache_memory_mb > 0 or result_cache_dir or result_cache_s3_location
+    else None
+)
+
+# Requests being processed by the queue workers are batched into one model call
+batcher = MicroBatcher(
+    inference_backend.process_batch,
+    thread_pool,
+    max_batch_size=max_batch_size,
+    max_wait_ms=max_batch_wait_ms,
+    max_inflight_batches=max_concurrent_invocations,
+)
+
+
+async def save_job_output(
+    job: dict, output_bytes: bytes, content_type: str, key: Optional[str] = None
+) -> AsyncInferenceResponse:
+    """Store the output of an inference job"""
+    # Parse locations
+    output_bucket, output_key = processor.parse_location(job["output_location"])
+
+    # Save output image
+    with job["timing"].stage("upload"):
+        output_path = await processor.save_output_image(
+            output_bytes, output_bucket, output_key, content_type
+        )
+
+    # Add the uploaded output to the S3 tier in the background
+    if key and result_cache.uses_s3:
+        processor.upload_executor.submit(
+            result_cache.store_to_s3, key, output_bucket, output_key
+        )
+
+    return AsyncInferenceResponse(
+        InferenceId=job["inference_id"], OutputLocation=output_path
+    )
+
+
+def lookup_result_cache(job: dict) -> tuple:
+    """Return the cache key of a job and its cached (output bytes, content type), if any"""
+    key = cache_key(
+        job["image_data"],
+        job["model_name"],
+        f"{processor.output_encoder.settings(job['output_format'])};"
+        f"{processor.resolution_policy.settings()}",
+    )
+    return key, result_cache.get(key)
+
+
+async def copy_cached_output(job: dict, key: str) -> Optional[AsyncInferenceResponse]:
+    """Server-side copy a result from the S3 tier to the output location
+
+    Returns None on a miss or an S3 error, so the job falls through to inference.
+    """
+    output_bucket, output_key = processor.parse_location(job["output_location"])
+    copied = await asyncio.get_running_loop().run_in_executor(
+        processor.upload_executor,
+        result_cache.copy_from_s3,
+        key,
+        output_bucket,
+        output_key,
+    )
+    if not copied:
+        return None
+    return AsyncInferenceResponse(
+        InferenceId=job["inference_id"], OutputLocation=job["output_location"]
+    )
+
+
+async def run_inference_job(job: dict) -> asyncio.Future:
+    """Run inference for a queued job and start uploading its output
+
+    Returns the upload task, so the queue worker can start the next inference
+    while the upload is still in progress. Inputs found in the result cache
+    skip inference; S3 tier hits return an already completed future.
+    """
+    timing = job["timing"]
+    loop = asyncio.get_running_loop()
+    timing.record("queue_wait", loop.time() - job["enqueued_at"])
+
+    # Validate the output location before spending time on inference
+    processor.parse_location(job["output_location"])
+
+    key = None
+    if result_cache:
+        with timing.stage("cache_lookup"):
+            key, cached = await asyncio.to_thread(lookup_result_cache, job)
+            response = None
+            if not cached and result_cache.uses_s3:
+                response = await copy_cached_output(job, key)
+        if cached:
+            logger.info(f"Result cache hit for {job['inference_id']}")
+            return await start_upload(job, *cached)
+        if response:
+            logger.info(f"Result cache hit in S3 for {job['inference_id']}")
+            done = loop.create_future()
+            done.set_result(response)
+            return done
+
+    # The raw request bytes are decoded only once, by the inference worker
+    start = time.perf_counter()
+    output_bytes, content_type, worker_timings = await batcher.submit(
+        (job["image_data"], job["output_format"], job["model_name"])
+    )
+    timing.record_all(worker_timings)
+    # Time spent waiting for the batch to form and for the other images in it
+    timing.record(
+        "batch_wait",
+        max(0.0, time.perf_counter() - start - sum(worker_timings.values())),
+    )
+
+    if result_cache:
+        await asyncio.to_thread(result_cache.put, key, output_bytes, content_type)
+    return await start_upload(job, output_bytes, content_type, key)
+
+
+async def start_upload(
+    job: dict, output_bytes: bytes, content_type: str, key: Optional[str] = None
+) -> asyncio.Task:
+    """Start uploading a job output in the background"""
+    # Bound the number of finished outputs waiting for upload
+    await upload_slots.acquire()
+    upload = asyncio.create_task(save_job_output(job, output_bytes, content_type, key))
+    upload.add_done_callback(lambda _: upload_slots.release())
+    return upload
+
+
+# Bounded queue in front of the workers; requests are only rejected once it is full.
+# Each worker holds its job until the batched inference returns, so there are
+# enough workers to fill every in-flight batch.
+work_queue = AdmissionQueue(
+    run_inference_job,
+    num_workers=max_concurrent_invocations * max_batch_size,
+    max_depth=max_queue_depth,
+)
+
+
+# Queued plus in-flight work, smoothed so the scaling signal does not flap
+backlog_estimator = BacklogEstimator(
+    half_life=float(os.environ.get("BACKLOG_EWMA_HALF_LIFE_SECONDS", "30"))
+)
+
+# Queue depth is sampled in the background instead of being sent per request (AWS only)
+metrics_aggregator = (
+    MetricsAggregator(
+        processor.cloudwatch_handler,
+        os.environ.get("SAGEMAKER_ENDPOINT_NAME", "rembg-async-app"),
+        lambda: backlog_estimator.update(work_queue.depth, work_queue.completed),
+        units={
+            "CompletionRatePerInstance": "Count/Second",
+            "EstimatedTimeToDrainSeconds": "Seconds",
+        },
+        sample_interval=float(os.environ.get("METRICS_SAMPLE_INTERVAL_SECONDS", "5")),
+        flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL_SECONDS", "60")),
+        mode=os.environ.get("METRICS_MODE", "cloudwatch").lower(),
+    )
+    if USE_AWS
+    else None
 )
 
 
 async def process_async_inference(
-    image_data: str, output_location: str, inference_id: str
+    image_data: bytes,
+    output_location: str,
+    inference_id: str,
+    deadline: float,
+    output_format: str,
+    request_model_name: str,
+    timing: RequestTiming,
 ):
     """Process async inference request with queue management"""
     try:
-        async with semaphore:
-            # Parse locations
-            output_bucket, output_key = processor.parse_location(output_location)
-
-            # Process image in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            # Convert PIL Image to bytes in memory
-            img_byte_arr = io.BytesIO()
-            image_data.save(img_byte_arr, format=image_data.format or "PNG")
-            img_byte_arr.seek(0)  # Reset buffer position to start
-            img_bytes = img_byte_arr.getvalue()
-
-            output_bytes = await loop.run_in_executor(
-                thread_pool, processor.process_image, img_bytes
-            )
-
-            # Save output image
-            output_path = await processor.save_output_image(
-                output_bytes, output_bucket, output_key
-            )
-
-            # Update metrics after processing (AWS only)
-            if USE_AWS:
-                backlog_size = max_concurrent_invocations - semaphore._value
-                endpoint_name = os.environ.get(
-                    "SAGEMAKER_ENDPOINT_NAME", "rembg-async-app"
-                )
-                processor.update_backlog_metric(endpoint_name, backlog_size)
-
-            return AsyncInferenceResponse(
-                InferenceId=inference_id, OutputLocation=output_path
-            )
+        upload = await work_queue.submit(
+            {
+                "image_data": image_data,
+                "output_location": output_location,
+                "inference_id": inference_id,
+                "output_format": output_format,
+                "model_name": request_model_name,
+                "timing": timing,
+                "enqueued_at": asyncio.get_running_loop().time(),
+            },
+            deadline,
+        )
+        # The queue worker hands over the upload without waiting for it, so the
+        # deadline is applied to the upload here. On expiry the upload keeps
+        # running in the background and its output may still appear.
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            return await asyncio.wait_for(asyncio.shield(upload), max(0.0, remaining))
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError("Deadline expired while uploading the output")
 
+    except QueueFullError as e:
+        logger.warning(f"Rejecting inference {inference_id}: {str(e)}")
+        raise HTTPException(
+            status_code=429, detail="Queue is full, please try again later"
+        )
+    except DeadlineExceededError as e:
+        logger.error(f"Inference {inference_id} timed out: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing async inference: {str(e)}")
-        if USE_AWS:
-            backlog_size = max_concurrent_invocations - semaphore._value
-            endpoint_name = os.environ.get("SAGEMAKER_ENDPOINT_NAME", "rembg-async-app")
-            processor.update_backlog_metric(endpoint_name, backlog_size)
         raise
 
 
+def parse_custom_attributes(custom_attributes: str) -> dict:
+    """Split ``name=value;name=value`` custom attributes
+
+    Values may contain ``=``; entries without one are ignored.
+    """
+    attributes = {}
+    for attr in custom_attributes.split(";"):
+        name, separator, value = attr.partition("=")
+        if separator:
+            attributes[name.strip()] = value.strip()
+    return attributes
+
+
 async def process_request_parameters(
-    inference_id: Optional[str] = None, custom_attributes: Optional[str] = None
+    inference_id: Optional[str] = None,
+    custom_attributes: Optional[str] = None,
+    accept: Optional[str] = None,
 ) -> dict:
     # Generate output location based on input location or custom attributes
     output_location = None
+    invocation_timeout = default_invocation_timeout
+    request_model_name = model_name
     if custom_attributes:
-        try:
-            custom_attrs = dict(
-                attr.split("=") for attr in custom_attributes.split(";") if "=" in attr
-            )
-            output_location = custom_attrs.get("output_location")
-        except Exception as e:
-            logger.warning(f"Failed to parse custom attributes: {e}")
+        # Each attribute is parsed on its own, so one bad value cannot discard the others
+        custom_attrs = parse_custom_attributes(custom_attributes)
+        output_location = custom_attrs.get("output_location") or None
+        request_model_name = custom_attrs.get("model") or model_name
+        if "invocation_timeout_seconds" in custom_attrs:
+            value = custom_attrs["invocation_timeout_seconds"]
+            try:
+                invocation_timeout = float(value)
+            except ValueError:
+                invocation_timeout = math.nan
+            if not (math.isfinite(invocation_timeout) and invocation_timeout > 0):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid invocation_timeout_seconds: {value!r}",
+                )
+
+    if request_model_name not in available_models:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model: {request_model_name}. Available models: {available_models}",
+        )
 
     # Generate or use provided inference ID
     final_inference_id = inference_id or str(time.time())
 
+    # Select the output encoding from the Accept header
+    output_format = OutputEncoder.resolve_format(accept)
+
     # Fallback to default output location if not specified in custom attributes
     if not output_location:
         output_bucket = os.environ.get("OUTPUT_BUCKET")
@@ -160,25 +490,36 @@ async def process_request_parameters(
             raise HTTPException(
                 status_code=500, detail="OUTPUT_BUCKET environment variable is not set"
             )
-        output_location = f"s3://{output_bucket}/output/{final_inference_id}.png"
-
-    # Check current queue size
-    current_backlog = max_concurrent_invocations - semaphore._value
-    if current_backlog >= max_concurrent_invocations:
-        raise HTTPException(
-            status_code=429, detail="Queue is full, please try again later"
+        output_location = (
+            f"s3://{output_bucket}/output/{final_inference_id}"
+            f"{OutputEncoder.extension(output_format)}"
         )
 
-    return {"output_location": output_location, "inference_id": final_inference_id}
+    # Derive the processing deadline from the invocation timeout
+    deadline = asyncio.get_running_loop().time() + invocation_timeout
+
+    return {
+        "output_location": output_location,
+        "inference_id": final_inference_id,
+        "deadline": deadline,
+        "output_format": output_format,
+        "model_name": request_model_name,
+    }
 
 
-def create_inference_response(result: AsyncInferenceResponse) -> JSONResponse:
+def create_inference_response(
+    result: AsyncInferenceResponse, server_timing: Optional[str] = None
+) -> JSONResponse:
     """Create JSON response with appropriate headers"""
     headers = {
         "X-Amzn-SageMaker-OutputLocation": result.OutputLocation,
         "Content-Type": "application/json",
     }
 
+    # Stage durations of sampled requests
+    if server_timing:
+        headers["Server-Timing"] = server_timing
+
     # Add optional failure location if present
     if hasattr(result, "FailureLocation"):
         headers["X-Amzn-SageMaker-FailureLocation"] = result.FailureLocation
@@ -188,27 +529,27 @@ def create_inference_response(result: AsyncInferenceResponse) -> JSONResponse:
     )
 
 
-async def process_request(request: Request) -> tuple[any, SageMakerHeaders]:
+async def process_request(
+    request: Request, timing: RequestTiming
+) -> tuple[bytes, SageMakerHeaders]:
     """Process and validate the incoming request"""
     import json
     import io
     from PIL import Image
 
-    # Log raw request details
     headers = dict(request.headers)
-    logger.info("Raw request headers:")
-    logger.info(headers)
+    logger.debug(f"Raw request headers: {headers}")
 
     # Get request body and content type
-    body = await request.body()
+    with timing.stage("body_read"):
+        body = await request.body()
     content_type = request.headers.get("content-type", "").lower()
 
     # Process body based on content type
-    logger.info("Raw request body:")
     if "application/json" in content_type:
         try:
             body_content = json.loads(body)
-            logger.info(body_content)
+            logger.debug(f"Raw request body: {body_content}")
             raise HTTPException(
                 status_code=415, detail="Text/JSON processing is not implemented"
             )
@@ -219,10 +560,12 @@ async def process_request(request: Request) -> tuple[any, SageMakerHeaders]:
             )
     elif "image/" in content_type:
         try:
-            body_content = Image.open(io.BytesIO(body))
-            logger.info(
-                f"Image details - Format: {body_content.format}, Size: {body_content.size}, Mode: {body_content.mode}"
-            )
+            # Image.open only parses the header; pixel data is decoded by the worker
+            with Image.open(io.BytesIO(body)) as probe:
+                logger.debug(
+                    f"Image details - Format: {probe.format}, Size: {probe.size}, Mode: {probe.mode}"
+                )
+            body_content = body
         except Exception as e:
             logger.error(f"Failed to parse image: {e}")
             raise HTTPException(
@@ -235,34 +578,18 @@ async def process_request(request: Request) -> tuple[any, SageMakerHeaders]:
         )
 
     # Log request metadata
-    query_params = dict(request.query_params)
-    logger.info("Request query parameters:")
-    logger.info(query_params)
-
-    logger.info("Complete request information:")
-    logger.info(
-        {
-            "method": request.method,
-            "url": str(request.url),
-            "headers": headers,
-            "query_params": query_params,
-            "client": request.client,
-            "cookies": request.cookies,
-            "path_params": request.path_params,
-        }
-    )
-
-    # Log model directory contents
-    if os.path.exists(model_dir_path):
-        logger.info(f"Contents of {model_dir_path}:")
-        for root, dirs, files in os.walk(model_dir_path):
-            logger.info(f"Directory: {root}")
-            if dirs:
-                logger.info(f"Subdirectories: {dirs}")
-            if files:
-                logger.info(f"Files: {files}")
-    else:
-        logger.warning(f"{model_dir_path} does not exist")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            {
+                "method": request.method,
+                "url": str(request.url),
+                "headers": headers,
+                "query_params": dict(request.query_params),
+                "client": request.client,
+                "cookies": request.cookies,
+                "path_params": request.path_params,
+            }
+        )
 
     # Validate and create SageMaker headers
     sagemaker_headers = SageMakerHeaders(
@@ -271,13 +598,7 @@ async def process_request(request: Request) -> tuple[any, SageMakerHeaders]:
         custom_attributes=headers.get("x-amzn-sagemaker-custom-attributes"),
         inference_id=headers.get("x-amzn-sagemaker-inference-id"),
     )
-
-    # Log validated request details
-    logger.info("Validated SageMaker headers:")
-    logger.info(f"Content type: {sagemaker_headers.content_type}")
-    logger.info(f"Accept: {sagemaker_headers.accept}")
-    logger.info(f"Custom attributes: {sagemaker_headers.custom_attributes}")
-    logger.info(f"Inference ID: {sagemaker_headers.inference_id}")
+    logger.debug(f"Validated SageMaker headers: {sagemaker_headers}")
 
     return body_content, sagemaker_headers
 
@@ -288,13 +609,17 @@ async def predict_fn(request: Request):
     Endpoint for async model invocation that follows SageMaker async inference format
     See: https://docs.aws.amazon.com/ja_jp/sagemaker/latest/APIReference/API_runtime_InvokeEndpointAsync.html
     """
+    timing = RequestTiming(stage_metrics, timing_sample_rate)
+    start = time.perf_counter()
     try:
         # Process the request and get the body content
-        body_content, sagemaker_headers = await process_request(request)
+        body_content, sagemaker_headers = await process_request(request, timing)
 
         # Process request parameters
         request_params = await process_request_parameters(
-            sagemaker_headers.inference_id, sagemaker_headers.custom_attributes
+            sagemaker_headers.inference_id,
+            sagemaker_headers.custom_attributes,
+            sagemaker_headers.accept,
         )
 
         # Process the inference request
@@ -302,10 +627,15 @@ async def predict_fn(request: Request):
             body_content,
             request_params["output_location"],
             request_params["inference_id"],
+            request_params["deadline"],
+            request_params["output_format"],
+            request_params["model_name"],
+            timing,
         )
+        timing.record("total", time.perf_counter() - start)
 
         # Create and return response
-        return create_inference_response(result)
+        return create_inference_response(result, timing.server_timing_header())
 
     except ValueError as e:
         logger.error(f"Validation error: {str(e)}")
@@ -315,9 +645,21 @@ async def predict_fn(request: Request):
         if isinstance(e, HTTPException):
             raise
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timing.finish()
+
+
+@app.get("/metrics")
+async def metrics():
+    """Stage latency histograms in the Prometheus text format"""
+    return PlainTextResponse(
+        stage_metrics.render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
 
 
 @app.get("/ping")
 async def ping():
-    """Healthcheck endpoint"""
-    return {"status": "healthy"}
+    """Healthcheck endpoint, healthy once the models are warmed up"""
+    if not inference_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "warming up"})
+    return {"status": "healthy", "warmup_seconds": warmup_timings}
@@ -1,12 +1,21 @@
 from abc import ABC, abstractmethod
+import asyncio
+import functools
 import io
 import logging
 import os
+import time
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from PIL import Image
-from rembg_handler import RembgHandler
+from session_registry import SessionRegistry, configured_models
 from cloudwatch_metrics import CloudWatchMetricsHandler
+from output_encoder import OutputEncoder, PNG
+from resolution_policy import ResolutionPolicy
 from dotenv import load_dotenv
 
 # Configure logging
@@ -21,16 +30,34 @@ load_dotenv()
 
 model_dir_path = os.environ.get("MODEL_PATH", "/opt/ml/model")
 
+MB = 1024 * 1024
+
+
+def parse_image_sizes(value: str) -> list:
+    """Parse "WxH,WxH" into [(width, height), ...]"""
+    sizes = []
+    for entry in value.split(","):
+        if entry.strip():
+            width, height = entry.lower().split("x")
+            sizes.append((int(width), int(height)))
+    return sizes
+
 
 class InferenceProcessor(ABC):
     """Abstract base class for image background removal inference processing"""
 
-    def __init__(self, model_name: str = "u2net", use_cloudwatch: bool = True):
+    def __init__(
+        self,
+        model_name: str = "u2net",
+        use_cloudwatch: bool = True,
+        load_model: bool = True,
+    ):
         self.model_name = model_name
-        self._create_session()
+        self.output_encoder = OutputEncoder()
+        self.resolution_policy = ResolutionPolicy()
         self.cloudwatch_handler = CloudWatchMetricsHandler() if use_cloudwatch else None
 
-        # Prepare model at initialization
+        # Prepare model files before the sessions load them
         try:
             logger.info(f"Initializing model files for {self.model_name}")
             self._check_models()
@@ -40,6 +67,10 @@ class InferenceProcessor(ABC):
             )
             raise
 
+        # Worker processes own the session when inference runs in a process pool
+        if load_model:
+            self._create_session()
+
     def _create_session(self):
         try:
             import torch
@@ -51,10 +82,11 @@ class InferenceProcessor(ABC):
             else:
                 logger.info("Using CPU for inference")
 
-            # Create RembgHandler instance
-            self.handler = RembgHandler(self.model_name)
+            # Create the session registry and load the pinned models
+            self.sessions = SessionRegistry()
+            self.sessions.preload()
             logger.info(
-                f"Successfully created RembgHandler for model: {self.model_name}"
+                f"Successfully created session registry: {self.sessions.loaded_models}"
             )
 
         except Exception as e:
@@ -62,18 +94,23 @@ class InferenceProcessor(ABC):
             raise
 
     def _check_models(self) -> str:
-        """Download model files if they don't exist"""
+        """Extract model files from model.tar.gz unless an earlier extraction is still valid"""
         models_dir = Path(model_dir_path)
         model_path = models_dir / f"{self.model_name}.onnx"
         tar_path = models_dir / "model.tar.gz"
+        marker_path = models_dir / ".model.tar.gz.extracted"
 
         logger.info(f"Checking for model files in {models_dir}")
         logger.info(f"Looking for model file: {model_path}")
         logger.info(f"Looking for tar archive: {tar_path}")
 
-        if not model_path.exists():
-            if tar_path.exists():
-                logger.info(f"Found tar archive at {tar_path}")
+        if tar_path.exists():
+            stat = tar_path.stat()
+            fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+            cached = marker_path.exists() and marker_path.read_text() == fingerprint
+            if cached and model_path.exists():
+                logger.info(f"Reusing models extracted from {tar_path}")
+            else:
                 logger.info(f"Starting model extraction from {tar_path}")
                 import tarfile
 
@@ -81,61 +118,164 @@ class InferenceProcessor(ABC):
                     logger.info("Extracting tar archive contents...")
                     tar.extractall(path=models_dir)
                     logger.info(f"Extraction completed to {models_dir}")
-
-                if not model_path.exists():
-                    logger.error(f"Model file not found after extraction: {model_path}")
-                    logger.error("Contents of model directory:")
-                    for file in models_dir.iterdir():
-                        logger.error(f"- {file}")
-                    raise FileNotFoundError(
-                        f"Model file not found after extraction: {model_path}"
-                    )
-            else:
-                logger.info(
-                    f"Neither model file nor tar archive found: {model_path}, {tar_path}"
-                )
+                try:
+                    marker_path.write_text(fingerprint)
+                except OSError as e:
+                    logger.warning(f"Could not record extraction marker: {str(e)}")
+
+            if not model_path.exists():
+                logger.error(f"Model file not found after extraction: {model_path}")
+                logger.error("Contents of model directory:")
+                for file in models_dir.iterdir():
+                    logger.error(f"- {file}")
                 raise FileNotFoundError(
-                    f"Neither model file nor tar archive found: {model_path}, {tar_path}"
+                    f"Model file not found after extraction: {model_path}"
                 )
+        elif not model_path.exists():
+            logger.info(
+                f"Neither model file nor tar archive found: {model_path}, {tar_path}"
+            )
+            raise FileNotFoundError(
+                f"Neither model file nor tar archive found: {model_path}, {tar_path}"
+            )
         else:
             logger.info(f"Found existing model file at {model_path}")
 
+        for available_model in configured_models():
+            if not (models_dir / f"{available_model}.onnx").exists():
+                logger.warning(
+                    f"Model file for {available_model} is missing from {models_dir}"
+                )
+
         self.model_path = model_path
         logger.info(f"Model files successfully are prepared at: {self.model_path}")
 
         return str(self.model_path)
 
-    def process_image(self, image_data: bytes) -> bytes:
-        """Process image using the loaded model"""
+    def process_image(
+        self,
+        image_data: bytes,
+        output_format: str = PNG,
+        model_name: Optional[str] = None,
+    ) -> tuple:
+        """Process image using the requested model
+
+        Returns:
+            tuple: (encoded output bytes, content type)
+        """
         try:
-            image = Image.open(io.BytesIO(image_data))
-            logger.info(
+            image = self.resolution_policy.decode(image_data)
+            logger.debug(
                 f"Input image opened successfully: size={image.size}, mode={image.mode}"
             )
 
-            output_image = self.handler.predict(image)
-            logger.info(f"Prediction completed: output_image type={type(output_image)}")
-            img_byte_arr = io.BytesIO()
-            output_image.save(img_byte_arr, format="PNG")
-            logger.info("Successfully saved output image to bytes")
+            handler = self.sessions.get(model_name or self.model_name)
+            output_image = handler.predict(image, self.resolution_policy.lowres_mask)
+            logger.debug(f"Prediction completed: output_image type={type(output_image)}")
 
-            return img_byte_arr.getvalue()
+            return self._encode_output(output_image, output_format)
         except Exception as e:
             logger.error(f"Error processing image: {str(e)}")
             raise
 
-    def update_backlog_metric(self, endpoint_name: str, backlog_size: int) -> None:
-        """Update CloudWatch metrics for queue monitoring"""
+    def process_batch(self, requests: list) -> list:
+        """Process (image bytes, output format, model name) requests, one batched call per model
+
+        Returns:
+            list: (encoded output bytes, content type, stage timings) per request,
+            in request order. The timings map decode, inference and encode to
+            seconds; inference is the duration of the whole batched call.
+        """
         try:
-            if self.cloudwatch_handler:
-                self.cloudwatch_handler.put_backlog_metric(endpoint_name, backlog_size)
+            # Group requests by model so each group runs as one forward pass
+            groups: dict = {}
+            for index, (_, _, model_name) in enumerate(requests):
+                groups.setdefault(model_name or self.model_name, []).append(index)
+
+            results = [None] * len(requests)
+            for model_name, indices in groups.items():
+                handler = self.sessions.get(model_name)
+                images = []
+                decode_times = []
+                for i in indices:
+                    start = time.perf_counter()
+                    images.append(self.resolution_policy.decode(requests[i][0]))
+                    decode_times.append(time.perf_counter() - start)
+                logger.debug(
+                    f"Input batch decoded: {len(images)} images for {model_name}"
+                )
+
+                start = time.perf_counter()
+                output_images = handler.predict_batch(
+                    images, self.resolution_policy.lowres_mask
+                )
+                inference_time = time.perf_counter() - start
+                logger.debug(f"Batch prediction completed: {len(output_images)} outputs")
+
+                for i, output_image, decode_time in zip(
+                    indices, output_images, decode_times
+                ):
+                    start = time.perf_counter()
+                    output_bytes, content_type = self._encode_output(
+                        output_image, requests[i][1]
+                    )
+                    results[i] = (
+                        output_bytes,
+                        content_type,
+                        {
+                            "decode": decode_time,
+                            "inference": inference_time,
+                            "encode": time.perf_counter() - start,
+                        },
+                    )
+            return results
         except Exception as e:
-            logger.error(f"Error updating backlog metric: {str(e)}")
+            logger.error(f"Error processing image batch: {str(e)}")
             raise
 
+    def warm_up(self, image_sizes: list, batch_size: int = 1) -> dict:
+        """Run synthetic images through every configured model
+
+        Each size is processed alone and as a batch of ``batch_size`` so that
+        sessions are loaded and kernels for both paths are initialized before
+        real traffic arrives. Failures are logged and do not stop the warm-up.
+
+        Returns:
+            dict: seconds per "model/WxH/batchN" run
+        """
+        timings = {}
+        for model_name in configured_models():
+            for width, height in image_sizes:
+                buffer = io.BytesIO()
+                Image.effect_noise((width, height), 64).convert("RGB").save(
+                    buffer, format="PNG", compress_level=1
+                )
+                image_data = buffer.getvalue()
+                for size in sorted({1, max(1, batch_size)}):
+                    run = f"{model_name}/{width}x{height}/batch{size}"
+                    start = time.perf_counter()
+                    try:
+                        self.process_batch([(image_data, PNG, model_name)] * size)
+                    except Exception as e:
+                        logger.error(f"Warm-up {run} failed: {str(e)}")
+                        continue
+                    timings[run] = time.perf_counter() - start
+                    logger.info(f"Warm-up {run} took {timings[run]:.3f}s")
+        return timings
+
+    def _encode_output(self, output_image: Image.Image, output_format: str) -> tuple:
+        """Encode an output image in the requested format"""
+        output = self.output_encoder.encode(output_image, output_format)
+        logger.debug(f"Successfully encoded output image as {output_format}")
+        return output
+
     @abstractmethod
     async def save_output_image(
-        self, output_bytes: bytes, output_bucket: str, output_key: str
+        self,
+        output_bytes: bytes,
+        output_bucket: str,
+        output_key: str,
+        content_type: str = "image/png",
     ) -> str:
         """Save output image to storage"""
         pass
@@ -147,53 +287,96 @@ class InferenceProcessor(ABC):
         parts = location.replace("s3://", "").split("/")
         bucket = parts[0]
         key = "/".join(parts[1:])
-        logger.info(f"Parsed location - bucket: {bucket}, key: {key}")
+        logger.debug(f"Parsed location - bucket: {bucket}, key: {key}")
         return bucket, key
 
 
 class LocalInferenceProcessor(InferenceProcessor):
     """Local file system implementation of inference processor"""
 
-    def __init__(self, model_name: str = "u2net"):
-        super().__init__(model_name, use_cloudwatch=False)
+    def __init__(self, model_name: str = "u2net", load_model: bool = True):
+        super().__init__(model_name, use_cloudwatch=False, load_model=load_model)
 
     async def save_output_image(
-        self, output_bytes: bytes, output_bucket: str, output_key: str
+        self,
+        output_bytes: bytes,
+        output_bucket: str,
+        output_key: str,
+        content_type: str = "image/png",
     ) -> str:
         """Save output image to local file system"""
         try:
             local_path = f"{output_bucket}/{output_key}"
-            logger.info(f"Saving to local path: {local_path}")
-            # Create output directory if it doesn't exist
-            output_dir = Path(local_path).parent
-            output_dir.mkdir(parents=True, exist_ok=True)
-
-            with open(local_path, "wb") as f:
-                f.write(output_bytes)
+            logger.debug(f"Saving to local path: {local_path}")
+            # Write the file off the event loop
+            await asyncio.to_thread(self._write_file, local_path, output_bytes)
 
             return f"s3://{output_bucket}/{output_key}"
         except Exception as e:
             logger.error(f"Error saving output image: {str(e)}")
             raise
 
+    @staticmethod
+    def _write_file(local_path: str, output_bytes: bytes) -> None:
+        # Create output directory if it doesn't exist
+        output_dir = Path(local_path).parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(local_path, "wb") as f:
+            f.write(output_bytes)
+
 
 class AWSInferenceProcessor(InferenceProcessor):
     """AWS S3 implementation of inference processor"""
 
-    def __init__(self, model_name: str = "u2net"):
-        super().__init__(model_name, use_cloudwatch=True)
-        self.s3 = boto3.client("s3")
+    def __init__(self, model_name: str = "u2net", load_model: bool = True):
+        super().__init__(model_name, use_cloudwatch=True, load_model=load_model)
+        upload_workers = int(os.environ.get("S3_UPLOAD_WORKERS", "8"))
+        multipart_concurrency = int(os.environ.get("S3_MULTIPART_CONCURRENCY", "4"))
+        # Every multipart part thread of every concurrent upload needs a connection
+        max_pool_connections = int(
+            os.environ.get(
+                "S3_MAX_POOL_CONNECTIONS", str(upload_workers * multipart_concurrency)
+            )
+        )
+        self.s3 = boto3.client(
+            "s3", config=Config(max_pool_connections=max_pool_connections)
+        )
+        # Dedicated I/O threads keep uploads off the event loop and the inference pool
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="s3-upload"
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(os.environ.get("S3_MULTIPART_THRESHOLD_MB", "8"))
+            * MB,
+            multipart_chunksize=int(os.environ.get("S3_MULTIPART_CHUNKSIZE_MB", "8"))
+            * MB,
+            max_concurrency=multipart_concurrency,
+        )
 
     async def save_output_image(
-        self, output_bytes: bytes, output_bucket: str, output_key: str
+        self,
+        output_bytes: bytes,
+        output_bucket: str,
+        output_key: str,
+        content_type: str = "image/png",
     ) -> str:
-        """Save output image to S3"""
+        """Save output image to S3 without blocking the event loop
+
+        Outputs above the multipart threshold are uploaded in parallel parts.
+        """
         try:
-            self.s3.put_object(
-                Bucket=output_bucket,
-                Key=output_key,
-                Body=output_bytes,
-                ContentType="image/png",
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self.upload_executor,
+                functools.partial(
+                    self.s3.upload_fileobj,
+                    io.BytesIO(output_bytes),
+                    output_bucket,
+                    output_key,
+                    ExtraArgs={"ContentType": content_type},
+                    Config=self.transfer_config,
+                ),
             )
             return f"s3://{output_bucket}/{output_key}"
         except Exception as e:
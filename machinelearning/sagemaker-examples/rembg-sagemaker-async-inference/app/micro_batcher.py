@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects concurrent inference requests into micro-batches
+
+    Requests are gathered until either ``max_batch_size`` items are pending or
+    ``max_wait_ms`` has elapsed since the first item of the batch arrived. The
+    batch is then handed to ``process_batch`` in the executor as a single call
+    and the results are fanned back out to the waiting requests. A failed batch
+    is retried one request at a time so that a single bad input only fails its
+    own request.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[list], list],
+        executor: Executor,
+        max_batch_size: int = 4,
+        max_wait_ms: float = 10.0,
+        max_inflight_batches: int = 1,
+    ):
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._max_inflight_batches = max(1, max_inflight_batches)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the batching loop on the running event loop"""
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self._max_inflight_batches)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Micro-batcher started: max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f}"
+        )
+
+    async def stop(self) -> None:
+        """Stop the batching loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, request: Any) -> Any:
+        """Queue a request for batched inference and wait for its result"""
+        if self._task is None:
+            raise RuntimeError("Micro-batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free executor slot before forming the batch, so that
+            # requests keep accumulating under load instead of being dispatched
+            # as single images
+            await self._slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(
+                            await asyncio.wait_for(self._queue.get(), timeout)
+                        )
+                    except asyncio.TimeoutError:
+                        break
+            except BaseException:
+                self._slots.release()
+                raise
+
+            task = asyncio.create_task(self._dispatch(batch))
+            task.add_done_callback(lambda _: self._slots.release())
+
+    async def _dispatch(self, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        requests = [request for request, _ in batch]
+        logger.debug(f"Dispatching micro-batch of {len(requests)} image(s)")
+        try:
+            outputs = await loop.run_in_executor(
+                self.executor, self.process_batch, requests
+            )
+        except Exception as e:
+            # Isolate the failing request(s) by retrying each image on its own
+            logger.warning(f"Batch inference failed, retrying per image: {str(e)}")
+            for request, future in batch:
+                if future.done():
+                    continue
+                try:
+                    outputs = await loop.run_in_executor(
+                        self.executor, self.process_batch, [request]
+                    )
+                    future.set_result(outputs[0])
+                except Exception as single_error:
+                    future.set_exception(single_error)
+            return
+
+        for (_, future), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
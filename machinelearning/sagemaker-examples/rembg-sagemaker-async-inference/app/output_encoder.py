@@ -0,0 +1,105 @@
+import io
+import logging
+import os
+from typing import Optional
+
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Output formats and the Accept media types that select them
+PNG = "png"
+WEBP = "webp"
+MASK = "mask"
+ACCEPT_FORMATS = {
+    "image/png": PNG,
+    "image/webp": WEBP,
+    "application/x-alpha-mask": MASK,
+}
+CONTENT_TYPES = {PNG: "image/png", WEBP: "image/webp", MASK: "image/png"}
+EXTENSIONS = {PNG: ".png", WEBP: ".webp", MASK: "_mask.png"}
+
+
+class OutputEncoder:
+    """Encodes background-removed images in the format requested by Accept
+
+    - ``png``: RGBA PNG with a low zlib level, trading size for encode speed
+    - ``webp``: RGBA WebP, lossless by default
+    - ``mask``: only the alpha channel, as an 8-bit grayscale PNG
+    """
+
+    def __init__(
+        self,
+        png_compress_level: Optional[int] = None,
+        webp_lossless: Optional[bool] = None,
+        webp_quality: Optional[int] = None,
+        webp_method: Optional[int] = None,
+    ):
+        self.png_compress_level = (
+            png_compress_level
+            if png_compress_level is not None
+            else int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+        )
+        self.webp_lossless = (
+            webp_lossless
+            if webp_lossless is not None
+            else os.environ.get("WEBP_LOSSLESS", "true").lower() == "true"
+        )
+        self.webp_quality = (
+            webp_quality
+            if webp_quality is not None
+            else int(os.environ.get("WEBP_QUALITY", "80"))
+        )
+        self.webp_method = (
+            webp_method
+            if webp_method is not None
+            else int(os.environ.get("WEBP_METHOD", "2"))
+        )
+
+    @staticmethod
+    def resolve_format(accept: Optional[str]) -> str:
+        """Pick the first supported output format from an Accept header value"""
+        if accept:
+            for media_range in accept.split(","):
+                media_type = media_range.split(";")[0].strip().lower()
+                if media_type in ACCEPT_FORMATS:
+                    return ACCEPT_FORMATS[media_type]
+            logger.info(f"Unsupported Accept value {accept}, falling back to PNG")
+        return PNG
+
+    @staticmethod
+    def extension(output_format: str) -> str:
+        """File name suffix for an output format"""
+        return EXTENSIONS[output_format]
+
+    def settings(self, output_format: str) -> str:
+        """Encoder settings that determine the bytes produced for an output format"""
+        if output_format == WEBP:
+            return (
+                f"{WEBP}:lossless={self.webp_lossless},"
+                f"quality={self.webp_quality},method={self.webp_method}"
+            )
+        return f"{output_format}:compress_level={self.png_compress_level}"
+
+    def encode(self, image: Image.Image, output_format: str = PNG) -> tuple:
+        """Encode an RGBA image and return (bytes, content type)"""
+        buffer = io.BytesIO()
+        if output_format == WEBP:
+            image.save(
+                buffer,
+                format="WEBP",
+                lossless=self.webp_lossless,
+                quality=self.webp_quality,
+                method=self.webp_method,
+            )
+        elif output_format == MASK:
+            image.getchannel("A").save(
+                buffer, format="PNG", compress_level=self.png_compress_level
+            )
+        else:
+            image.save(buffer, format="PNG", compress_level=self.png_compress_level)
+        return buffer.getvalue(), CONTENT_TYPES[output_format]
@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Processor owned by the current worker process, created once by the initializer
+_worker_processor = None
+# Warm-up timings of the current worker process
+_worker_warmup_timings: dict = {}
+# Barrier shared by all worker processes, used once to confirm they all started
+_worker_start_barrier = None
+
+
+def _init_worker(
+    model_name: str, warmup_sizes: list, warmup_batch_size: int, start_barrier
+) -> None:
+    """Load and warm up the models once per worker process"""
+    global _worker_processor, _worker_warmup_timings, _worker_start_barrier
+    from inference_processor import LocalInferenceProcessor
+
+    _worker_start_barrier = start_barrier
+    logger.info(f"Loading model {model_name} in worker process {os.getpid()}")
+    _worker_processor = LocalInferenceProcessor(model_name)
+    if warmup_sizes:
+        _worker_warmup_timings = _worker_processor.warm_up(
+            warmup_sizes, warmup_batch_size
+        )
+
+
+def _worker_ready() -> tuple:
+    # Hold this worker until every worker has picked up a task, so that each
+    # task of ProcessPoolInference.start reports a different process
+    _worker_start_barrier.wait()
+    return os.getpid(), _worker_warmup_timings
+
+
+def _to_shared_memory(data: bytes) -> SharedMemory:
+    # Zero-length segments are not allowed
+    shm = SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[: len(data)] = data
+    return shm
+
+
+def _read_shared_memory(name: str, size: int, unlink: bool = False) -> bytes:
+    shm = SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _process_shared_batch(segments: list) -> list:
+    """Run a batch in the worker, reading inputs from and writing outputs to shared memory"""
+    requests = [
+        (_read_shared_memory(name, size), output_format, model_name)
+        for name, size, output_format, model_name in segments
+    ]
+    outputs = _worker_processor.process_batch(requests)
+
+    results = []
+    for output, content_type, timings in outputs:
+        shm = _to_shared_memory(output)
+        results.append((shm.name, len(output), content_type, timings))
+        # The parent process unlinks the segment after reading it
+        shm.close()
+    return results
+
+
+class ProcessPoolInference:
+    """Runs inference in worker processes that each own a session registry
+
+    Decoding, prediction and encoding all hold the GIL for a large share of
+    each request, so a thread pool cannot use more than one core for them.
+    Image bytes are passed to and from the workers through shared memory.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "u2net",
+        num_workers: int = 2,
+        warmup_sizes: Optional[list] = None,
+        warmup_batch_size: int = 1,
+    ):
+        self.model_name = model_name
+        self.num_workers = max(1, num_workers)
+        # spawn avoids forking a parent that already runs threads and an event loop
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(
+                model_name,
+                warmup_sizes or [],
+                warmup_batch_size,
+                context.Barrier(self.num_workers),
+            ),
+        )
+
+    def start(self) -> dict:
+        """Start and warm up the worker processes before traffic arrives
+
+        Returns only once every worker process has loaded its models: the ready
+        tasks wait on a barrier, so no worker can run two of them.
+
+        Returns:
+            dict: warm-up timings per worker process id
+        """
+        futures = [
+            self.executor.submit(_worker_ready) for _ in range(self.num_workers)
+        ]
+        timings = dict(future.result() for future in futures)
+        if len(timings) != self.num_workers:
+            raise RuntimeError(
+                f"Only {len(timings)} of {self.num_workers} worker processes started"
+            )
+        logger.info(f"Inference worker processes ready: {sorted(timings)}")
+        return timings
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def process_batch(self, requests: list) -> list:
+        """Process (image bytes, output format, model name) requests in one worker process"""
+        segments = [_to_shared_memory(image_data) for image_data, _, _ in requests]
+        try:
+            results = self.executor.submit(
+                _process_shared_batch,
+                [
+                    (shm.name, len(image_data), output_format, model_name)
+                    for shm, (image_data, output_format, model_name) in zip(
+                        segments, requests
+                    )
+                ],
+            ).result()
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+        return [
+            (_read_shared_memory(name, size, unlink=True), content_type, timings)
+            for name, size, content_type, timings in results
+        ]
@@ -1,5 +1,12 @@
 import os
-from PIL import Image
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import onnxruntime as ort
+from PIL import Image, ImageOps
+from rembg.sessions import sessions_class
 from rembg.sessions.base import BaseSession
 from rembg import remove, new_session
 import logging
@@ -15,21 +22,206 @@ load_dotenv()
 
 model_dir_path = os.environ.get("MODEL_PATH", "/opt/ml/model")
 model_name = os.environ.get("MODEL_NAME", "u2net")
+# Graph-optimized models are serialized here and reused on the next start.
+# MODEL_PATH is read-only on SageMaker, so the default is the temp directory.
+ort_cache_enabled = os.environ.get("ORT_OPTIMIZED_MODEL_CACHE", "true").lower() == "true"
+ort_cache_dir = os.environ.get(
+    "ORT_OPTIMIZED_MODEL_DIR", os.path.join(tempfile.gettempdir(), "ort-cache")
+)
+# Images with at least this many pixels are processed in tiles (0 disables tiling)
+tiled_min_pixels = int(os.environ.get("TILED_INFERENCE_MIN_PIXELS", "16000000"))
+tile_size = int(os.environ.get("TILE_SIZE", "1024"))
+# Longest side of the downscaled copy used to predict the mask of a tiled image
+tiled_mask_max_side = int(os.environ.get("TILED_MASK_MAX_SIDE", "2048"))
+
+# Pre-processing parameters of the rembg sessions that produce a single mask and
+# can therefore run several images through one ONNX forward pass.
+# model name -> (mean, std, model input size, apply sigmoid to the output)
+BATCHABLE_MODELS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320), False),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320), False),
+    "u2net_human_seg": (
+        (0.485, 0.456, 0.406),
+        (0.229, 0.224, 0.225),
+        (320, 320),
+        False,
+    ),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320), False),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024), False),
+    "isnet-anime": ((0.485, 0.456, 0.406), (1.0, 1.0, 1.0), (1024, 1024), False),
+    "birefnet-general": (
+        (0.485, 0.456, 0.406),
+        (0.229, 0.224, 0.225),
+        (1024, 1024),
+        True,
+    ),
+}
+
+
+# EXIF orientation -> transpose that displays the stored image upright
+EXIF_ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+# Transposes that swap the width and the height
+AXIS_SWAPPING_TRANSPOSES = {
+    Image.TRANSPOSE,
+    Image.ROTATE_270,
+    Image.TRANSVERSE,
+    Image.ROTATE_90,
+}
+
+
+def _stored_box(box: tuple, method: Optional[int], stored_size: tuple) -> tuple:
+    """Map a box of the upright image to the same region of the stored image"""
+    if method is None:
+        return box
+    width, height = stored_size
+    left, top, right, bottom = box
+    # Where the corners of the upright box come from in the stored image
+    corners = {
+        Image.FLIP_LEFT_RIGHT: lambda x, y: (width - x, y),
+        Image.ROTATE_180: lambda x, y: (width - x, height - y),
+        Image.FLIP_TOP_BOTTOM: lambda x, y: (x, height - y),
+        Image.TRANSPOSE: lambda x, y: (y, x),
+        Image.ROTATE_270: lambda x, y: (y, height - x),
+        Image.TRANSVERSE: lambda x, y: (width - y, height - x),
+        Image.ROTATE_90: lambda x, y: (width - y, x),
+    }[method]
+    (x1, y1), (x2, y2) = corners(left, top), corners(right, bottom)
+    return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+
+def verify_model_checksum(model_path: Path) -> None:
+    """Verify a model file against its ``<model>.onnx.sha256`` sidecar, if present"""
+    checksum_path = model_path.with_name(model_path.name + ".sha256")
+    if not checksum_path.exists():
+        logger.warning(f"No checksum file for {model_path}, skipping verification")
+        return
+
+    expected = checksum_path.read_text().split()[0].lower()
+    sha256 = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    if sha256.hexdigest() != expected:
+        raise ValueError(
+            f"Checksum mismatch for {model_path}: "
+            f"expected {expected}, got {sha256.hexdigest()}"
+        )
+    logger.info(f"Checksum verified for {model_path}")
+
+
+def _session_options() -> ort.SessionOptions:
+    # Same thread setting as rembg.new_session
+    sess_opts = ort.SessionOptions()
+    if "OMP_NUM_THREADS" in os.environ:
+        sess_opts.inter_op_num_threads = int(os.environ["OMP_NUM_THREADS"])
+    return sess_opts
+
+
+def _optimized_model_path(model_path: Path) -> Path:
+    """Cache path keyed by the model file and the available execution providers"""
+    stat = model_path.stat()
+    key = f"{stat.st_size}-{stat.st_mtime_ns}-{','.join(ort.get_available_providers())}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return Path(ort_cache_dir) / f"{model_path.stem}-{digest}.onnx"
+
+
+def _new_local_session(session_name: str, load_path: Path, sess_opts) -> BaseSession:
+    """Create a rembg session that loads ``load_path`` instead of downloading weights"""
+    session_class = next((sc for sc in sessions_class if sc.name() == session_name), None)
+    if session_class is None:
+        raise ValueError(f"Unsupported rembg model: {session_name}")
+
+    local_class = type(
+        session_class.__name__,
+        (session_class,),
+        {"download_models": classmethod(lambda cls, *args, **kwargs: str(load_path))},
+    )
+    return local_class(session_name, sess_opts)
+
+
+def create_session(session_name: str) -> BaseSession:
+    """Create a rembg session from the model file in MODEL_PATH
+
+    Falls back to rembg's own download when the file is not available locally.
+    """
+    model_path = Path(model_dir_path) / f"{session_name}.onnx"
+    if not model_path.exists():
+        logger.warning(f"{model_path} not found, downloading {session_name} with rembg")
+        return new_session(session_name)
+
+    verify_model_checksum(model_path)
+    if not ort_cache_enabled:
+        return _new_local_session(session_name, model_path, _session_options())
+
+    optimized_path = _optimized_model_path(model_path)
+    if optimized_path.exists():
+        # The cached graph is already optimized, so skip optimization on load
+        sess_opts = _session_options()
+        sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            session = _new_local_session(session_name, optimized_path, sess_opts)
+            logger.info(f"Loaded optimized model from {optimized_path}")
+            return session
+        except Exception as e:
+            logger.warning(f"Discarding unusable optimized model {optimized_path}: {e}")
+            try:
+                optimized_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    sess_opts = _session_options()
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    try:
+        optimized_path.parent.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Optimized model cache is not writable: {e}")
+    else:
+        sess_opts.optimized_model_filepath = str(optimized_path)
+        try:
+            session = _new_local_session(session_name, model_path, sess_opts)
+            logger.info(f"Loaded model from {model_path}, saved {optimized_path}")
+            return session
+        except Exception as e:
+            # Failing to write the cache must not fail the model load
+            logger.warning(f"Could not save optimized model {optimized_path}: {e}")
+            sess_opts = _session_options()
+            sess_opts.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            )
+    session = _new_local_session(session_name, model_path, sess_opts)
+    logger.info(f"Loaded model from {model_path}")
+    return session
 
 
 class RembgHandler:
-    # request_model_name はリクエストヘッダの情報ごとにモデルを切り替える対応用、未実装
-    def __init__(self, request_model_name: str):
-        # 絶対 new_session でgithubからモデルダウンロードする.. /opt/ml/model をロードしても意味ない状態
-        self.session = new_session(model_name)
+    # request_model_name はリクエストのカスタム属性で選択されたモデル名
+    def __init__(self, request_model_name: str = model_name):
+        # MODEL_PATH に展開されたモデルファイルからセッションを作成する
+        self.model_name = request_model_name
+        self.session = create_session(request_model_name)
+        self.supports_batching = self._supports_batching()
 
-    def predict(self, image: Image.Image) -> Image.Image:
-        """Remove background from image using the created session"""
+    def predict(self, image: Image.Image, lowres_mask: bool = False) -> Image.Image:
+        """Remove background from image using the created session
+
+        With ``lowres_mask`` the mask is predicted on a downscaled copy and
+        upsampled while it is applied, as in the tiled path.
+        """
+        if lowres_mask or self._use_tiling(image):
+            return self.predict_downscaled_mask(image)
         try:
-            logger.info("Starting background removal with rembg")
+            logger.debug("Starting background removal with rembg")
             output = remove(image, session=self.session)
-            logger.info(f"Remove operation completed, output type: {type(output)}")
-            logger.info(
+            logger.debug(f"Remove operation completed, output type: {type(output)}")
+            logger.debug(
                 f"Successfully processed image: size={output.size}, mode={output.mode}"
             )
             return output
@@ -37,3 +229,154 @@ class RembgHandler:
         except Exception as e:
             logger.error(f"Error in predict: {str(e)}")
             raise
+
+    def predict_batch(self, images: list, lowres_mask: bool = False) -> list:
+        """Remove background from several images with a single ONNX forward pass
+
+        Falls back to per-image prediction when the model is not batchable.
+        With ``lowres_mask`` the masks are upsampled bilinearly instead of with
+        LANCZOS.
+        """
+        if len(images) == 1 or not self.supports_batching:
+            return [self.predict(image, lowres_mask) for image in images]
+
+        # Very large images take the downscaled-mask path on their own
+        tiled = [i for i, image in enumerate(images) if self._use_tiling(image)]
+        if tiled:
+            outputs = [None] * len(images)
+            for i in tiled:
+                outputs[i] = self.predict_downscaled_mask(images[i])
+            rest = [i for i in range(len(images)) if i not in tiled]
+            if rest:
+                rest_outputs = self.predict_batch(
+                    [images[i] for i in rest], lowres_mask
+                )
+                for i, output in zip(rest, rest_outputs):
+                    outputs[i] = output
+            return outputs
+
+        logger.debug(f"Starting batched background removal for {len(images)} images")
+        # rembg.remove fixes the EXIF orientation before predicting the mask
+        images = [ImageOps.exif_transpose(image) for image in images]
+        masks = self._predict_masks(
+            images, Image.BILINEAR if lowres_mask else Image.LANCZOS
+        )
+        outputs = []
+        for image, mask in zip(images, masks):
+            empty = Image.new("RGBA", image.size, 0)
+            outputs.append(Image.composite(image.convert("RGBA"), empty, mask))
+        logger.debug(f"Successfully processed batch of {len(outputs)} images")
+        return outputs
+
+    def predict_downscaled_mask(self, image: Image.Image) -> Image.Image:
+        """Remove background with a mask predicted on a downscaled copy
+
+        The mask is predicted once on a copy whose longest side is at most
+        ``TILED_MASK_MAX_SIDE``, then bilinearly upsampled and applied tile by
+        tile; the tiles are not refined individually. The source image is only
+        read: the EXIF orientation and the RGB conversion are applied to the
+        downscaled copy and to each tile, so no full-resolution mask, rotated
+        copy or intermediate RGBA image is allocated (palette and bilevel images
+        are converted to RGB once, since they cannot be resampled smoothly).
+        """
+        try:
+            logger.info(
+                f"Starting downscaled-mask background removal: size={image.size}, "
+                f"tile={tile_size}"
+            )
+            # rembg.remove fixes the EXIF orientation before predicting the mask
+            method = EXIF_ORIENTATION_TRANSPOSE.get(image.getexif().get(0x0112))
+            stored_size = image.size
+            if method in AXIS_SWAPPING_TRANSPOSES:
+                width, height = stored_size[1], stored_size[0]
+            else:
+                width, height = stored_size
+
+            scale = min(1.0, tiled_mask_max_side / max(width, height))
+            small_size = (
+                max(1, round(stored_size[0] * scale)),
+                max(1, round(stored_size[1] * scale)),
+            )
+            # Downscale first and convert only the small copy
+            source = image.convert("RGB") if image.mode in ("1", "P") else image
+            small = source.resize(small_size, Image.BILINEAR, reducing_gap=3.0)
+            if method is not None:
+                small = small.transpose(method)
+            if small.mode != "RGB":
+                small = small.convert("RGB")
+            mask = self.session.predict(small)[0]
+            scale_x = mask.width / width
+            scale_y = mask.height / height
+
+            output = Image.new("RGBA", (width, height), 0)
+            for top in range(0, height, tile_size):
+                for left in range(0, width, tile_size):
+                    box = (
+                        left,
+                        top,
+                        min(left + tile_size, width),
+                        min(top + tile_size, height),
+                    )
+                    tile = source.crop(_stored_box(box, method, stored_size))
+                    if method is not None:
+                        tile = tile.transpose(method)
+                    tile = tile.convert("RGBA")
+                    tile_mask = mask.resize(
+                        tile.size,
+                        Image.BILINEAR,
+                        box=(
+                            box[0] * scale_x,
+                            box[1] * scale_y,
+                            box[2] * scale_x,
+                            box[3] * scale_y,
+                        ),
+                    )
+                    empty = Image.new("RGBA", tile.size, 0)
+                    output.paste(Image.composite(tile, empty, tile_mask), box[:2])
+
+            logger.info(f"Successfully processed tiled image: size={output.size}")
+            return output
+
+        except Exception as e:
+            logger.error(f"Error in predict_downscaled_mask: {str(e)}")
+            raise
+
+    def _use_tiling(self, image: Image.Image) -> bool:
+        return tiled_min_pixels > 0 and image.width * image.height >= tiled_min_pixels
+
+    def _supports_batching(self) -> bool:
+        """Check that the session post-processing is known and the batch axis is dynamic"""
+        if self.model_name not in BATCHABLE_MODELS:
+            logger.info(f"Batching is not supported for model: {self.model_name}")
+            return False
+        batch_dim = self.session.inner_session.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim == 1:
+            logger.info(f"Model {self.model_name} has a fixed batch size of 1")
+            return False
+        return True
+
+    def _predict_masks(self, images: list, resample: int = Image.LANCZOS) -> list:
+        """Run the session on a stacked batch and return one mask per image"""
+        mean, std, size, use_sigmoid = BATCHABLE_MODELS[self.model_name]
+        input_name = self.session.inner_session.get_inputs()[0].name
+        batch = np.concatenate(
+            [
+                self.session.normalize(image, mean, std, size)[input_name]
+                for image in images
+            ],
+            axis=0,
+        )
+        ort_outs = self.session.inner_session.run(None, {input_name: batch})
+        preds = ort_outs[0][:, 0, :, :]
+        if use_sigmoid:
+            preds = 1 / (1 + np.exp(-preds))
+
+        masks = []
+        for image, pred in zip(images, preds):
+            # Normalize each mask on its own, as the single-image sessions do
+            ma = np.max(pred)
+            mi = np.min(pred)
+            pred = (pred - mi) / (ma - mi)
+            mask = Image.fromarray((pred * 255).astype("uint8"), mode="L")
+            masks.append(mask.resize(image.size, resample))
+        return masks
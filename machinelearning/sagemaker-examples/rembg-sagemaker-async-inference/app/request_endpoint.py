@@ -4,11 +4,15 @@ import time
 import boto3
 import logging
 import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
+from botocore.config import Config
 from dotenv import load_dotenv
 from abc import ABC, abstractmethod
-from sagemaker_client import SageMakerClient
+from sagemaker_client import SageMakerClient, ThrottlingError
+from completion_waiter import CompletionWaiter
 
 # ロガーの設定
 logging.basicConfig(
@@ -23,6 +27,17 @@ logger = logging.getLogger(__name__)
 # .env ファイルから環境変数を読み込む
 load_dotenv()
 
+# 一括処理の対象とする画像の拡張子
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+def guess_image_mime_type(path: str) -> str:
+    """入力ファイルのMIMEタイプを取得する"""
+    mime_type, _ = mimetypes.guess_type(path)
+    if not mime_type or not mime_type.startswith("image/"):
+        mime_type = "image/jpeg"  # デフォルトのMIMEタイプ
+    return mime_type
+
 
 class BackgroundRemovalProcessor(ABC):
     """背景除去処理の基底クラス"""
@@ -101,9 +116,7 @@ class LocalBackgroundRemovalProcessor(BackgroundRemovalProcessor):
         self.logger.info("Sending async inference request to local endpoint")
 
         # 入力ファイルのMIMEタイプを取得
-        mime_type, _ = mimetypes.guess_type(input_location)
-        if not mime_type or not mime_type.startswith("image/"):
-            mime_type = "image/jpeg"  # デフォルトのMIMEタイプ
+        mime_type = guess_image_mime_type(input_location)
 
         response = self.sagemaker_client.invoke_endpoint_async(
             EndpointName=self.endpoint_name,
@@ -125,6 +138,9 @@ class LocalBackgroundRemovalProcessor(BackgroundRemovalProcessor):
 class AWSBackgroundRemovalProcessor(BackgroundRemovalProcessor):
     """AWS処理用の実装"""
 
+    # 処理完了を待つ最大秒数
+    COMPLETION_TIMEOUT_SECONDS = 60
+
     def __init__(self):
         super().__init__()
         self.s3 = boto3.client("s3")
@@ -137,6 +153,9 @@ class AWSBackgroundRemovalProcessor(BackgroundRemovalProcessor):
         self.error_topic_arn = os.environ["ERROR_TOPIC_ARN"]
         self.endpoint_name = os.environ["SAGEMAKER_ENDPOINT_NAME"]
 
+        # NOTIFICATION_QUEUE_URL が設定されていれば SNS 通知で完了を検知する
+        self.completion_waiter = CompletionWaiter(s3_client=self.s3).start()
+
         self.output_key = None
         self.s3_output_location = None
 
@@ -170,9 +189,10 @@ class AWSBackgroundRemovalProcessor(BackgroundRemovalProcessor):
         self.logger.info(f"Output will be saved to: s3://{self.s3_output_location}")
 
         # 入力ファイルのMIMEタイプを取得
-        mime_type, _ = mimetypes.guess_type(input_location)
-        if not mime_type or not mime_type.startswith("image/"):
-            mime_type = "image/jpeg"  # デフォルトのMIMEタイプ
+        mime_type = guess_image_mime_type(input_location)
+
+        # 通知を取りこぼさないようにリクエストの送信前に待機者を登録する
+        self.completion_waiter.register(inference_id)
 
         response = self.sagemaker_client.invoke_endpoint_async(
             EndpointName=self.endpoint_name,
@@ -194,41 +214,29 @@ class AWSBackgroundRemovalProcessor(BackgroundRemovalProcessor):
         )
 
         try:
-            # S3出力ファイルの存在をポーリング
-            MAX_ATTEMPTS = 30
-            WAIT_TIME = 2
-
-            for attempt in range(MAX_ATTEMPTS):
-                self.logger.info(
-                    f"Checking output file existence (attempt {attempt + 1}/{MAX_ATTEMPTS})"
+            # 完了通知を待ち、届かない場合は間隔を広げながら出力ファイルを確認する
+            result = self.completion_waiter.wait(
+                inference_id,
+                self.output_bucket,
+                self.output_key,
+                timeout=self.COMPLETION_TIMEOUT_SECONDS,
+            )
+            if result is None:
+                self.logger.error(
+                    f"Output file not found after {self.COMPLETION_TIMEOUT_SECONDS} seconds"
                 )
+                return False
+            if result["Status"] != "Completed":
+                self.logger.error(f"Inference failed: {result['FailureReason']}")
+                return False
 
-                try:
-                    # S3オブジェクトのメタデータを取得してファイルの存在を確認
-                    self.s3.head_object(Bucket=self.output_bucket, Key=self.output_key)
-                    self.logger.info("Output file found in S3")
-                    return True
-                except self.s3.exceptions.ClientError as e:
-                    if e.response["Error"]["Code"] == "404":
-                        if attempt < MAX_ATTEMPTS - 1:
-                            self.logger.info(
-                                f"Output file not found yet, waiting {WAIT_TIME} seconds..."
-                            )
-                            time.sleep(WAIT_TIME)
-                            continue
-                        else:
-                            self.logger.error(
-                                "Output file not found after maximum attempts"
-                            )
-                            return False
-                    else:
-                        self.logger.error(f"Error checking S3 object: {str(e)}")
-                        return False
-
-            return False
+            self.logger.info("Output file found in S3")
+            return True
         except Exception as e:
             self.logger.error(f"Error during wait_for_completion: {str(e)}")
             return False
+        finally:
+            self.completion_waiter.stop()
 
     def save_result(self, output_path: Path) -> bool:
         try:
@@ -273,19 +281,442 @@ def request_background_removal(
     return processor.process(input_image_path, local_output_path)
 
 
+def collect_inputs(source: str, output_dir: str) -> list:
+    """
+    ディレクトリまたはマニフェスト（1 行に 1 つの画像パス）から入力画像を列挙する
+
+    Returns:
+        list: (入力画像のパス, ローカル出力先のパス) のリスト
+    """
+    source_path = Path(source)
+    output_root = Path(output_dir)
+    inputs = []
+    if source_path.is_dir():
+        # サブディレクトリの構成を出力先でも保ち、同名ファイルの衝突を避ける
+        for path in sorted(source_path.rglob("*")):
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+                relative = path.relative_to(source_path)
+                inputs.append(
+                    (path, output_root / relative.parent / f"{path.stem}_output.png")
+                )
+    else:
+        with open(source_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    path = Path(line)
+                    # 別のディレクトリにある同名ファイルが上書きし合わないよう、
+                    # マニフェスト内の番号を出力ファイル名に含める
+                    name = f"{len(inputs):06d}_{path.stem}_output.png"
+                    inputs.append((path, output_root / name))
+    return inputs
+
+
+class TokenBucket:
+    """リクエストレートを制限するトークンバケット（スレッドセーフ）"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """トークンが得られるまで待機する（rate が 0 以下なら制限しない）"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BulkBackgroundRemoval:
+    """
+    大量の画像をまとめて背景除去する
+
+    アップロードと推論リクエストはスレッドプールで並列に行い、推論リクエストは
+    トークンバケットでレート制限する。AWS モードでは SNS の完了通知
+    （NOTIFICATION_QUEUE_URL）と、出力プレフィックスと失敗の出力先
+    （FailureLocation）のプレフィックスを list_objects_v2 でまとめて確認した結果で
+    完了・失敗を判定し、画像ごとのポーリングは行わない。
+    """
+
+    # 通知を受信している場合の、取りこぼし確認のための一覧の間隔（poll_interval の倍数）
+    LISTING_INTERVAL_FACTOR = 6
+
+    # キューが満杯（スロットリング）の場合の再試行
+    MAX_SUBMIT_ATTEMPTS = 8
+    INITIAL_BACKOFF_SECONDS = 0.5
+
+    def __init__(
+        self,
+        concurrency: int = 16,
+        rate: float = 10.0,
+        timeout: float = 3600.0,
+        poll_interval: float = 10.0,
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.use_aws = os.getenv("USE_AWS", "false").lower() == "true"
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.rate_limiter = TokenBucket(rate, burst=self.concurrency)
+        # 並列リクエスト用にコネクションをプールする
+        self.sagemaker_client = SageMakerClient(max_pool_connections=self.concurrency)
+
+        if self.use_aws:
+            self.s3 = boto3.client(
+                "s3", config=Config(max_pool_connections=self.concurrency)
+            )
+            self.input_bucket = os.environ["INPUT_BUCKET"]
+            self.output_bucket = os.environ["OUTPUT_BUCKET"]
+            self.endpoint_name = os.environ["SAGEMAKER_ENDPOINT_NAME"]
+            self.completion_waiter = CompletionWaiter(s3_client=self.s3)
+        else:
+            self.endpoint_name = "local-endpoint"
+            self.completion_waiter = None
+
+        # 受信した完了通知（出力の S3 キー -> 通知）
+        self.notified = {}
+        self.notified_lock = threading.Lock()
+        self.notified_event = threading.Event()
+
+        # 一括処理ごとの S3 プレフィックス
+        self.run_id = f"bulk-{int(time.time())}"
+
+    def run(self, inputs: list) -> list:
+        """
+        一括処理の実行
+
+        Args:
+            inputs: (入力画像のパス, ローカル出力先のパス) のリスト
+        Returns:
+            list: 処理に失敗した入力画像のパス
+        """
+        self.logger.info(
+            f"Processing {len(inputs)} images: concurrency={self.concurrency}, "
+            f"rate={self.rate_limiter.rate}/s"
+        )
+        started = time.monotonic()
+        failed = []
+        pending = {}
+        # 失敗の出力先（FailureLocation の S3 URI） -> 出力の S3 キー
+        failure_locations = {}
+        if self.completion_waiter:
+            self.completion_waiter.start()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # アップロードと推論リクエストの送信
+            futures = {
+                executor.submit(self.submit, index, input_path, output_path): (
+                    input_path,
+                    output_path,
+                )
+                for index, (input_path, output_path) in enumerate(inputs)
+            }
+            for future in as_completed(futures):
+                input_path, output_path = futures[future]
+                try:
+                    submitted = future.result()
+                    if submitted:
+                        output_key, failure_location = submitted
+                        pending[output_key] = (input_path, output_path)
+                        if failure_location:
+                            failure_locations[failure_location] = output_key
+                except Exception as e:
+                    self.logger.error(f"Failed to submit {input_path}: {str(e)}")
+                    failed.append(input_path)
+            self.logger.info(
+                f"Submitted {len(inputs) - len(failed)} requests "
+                f"in {time.monotonic() - started:.1f}s"
+            )
+
+            # 完了の待機と結果のダウンロード
+            if pending:
+                failed.extend(
+                    self.wait_for_outputs(pending, failure_locations, executor)
+                )
+
+        if self.completion_waiter:
+            self.completion_waiter.stop()
+
+        self.logger.info(
+            f"Completed {len(inputs) - len(failed)}/{len(inputs)} images "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+        return failed
+
+    def submit(
+        self, index: int, input_path: Path, output_path: Path
+    ) -> Optional[tuple]:
+        """
+        1 枚の画像をアップロードして推論リクエストを送信する
+
+        Returns:
+            Optional[tuple]: AWS モードでは (出力の S3 キー, FailureLocation)、
+                ローカルモードでは None
+        """
+        mime_type = guess_image_mime_type(str(input_path))
+        name = f"{index:06d}_{input_path.stem}"
+
+        if not self.use_aws:
+            # ローカルエンドポイントは出力を書き込んでからレスポンスを返す
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            response = self.invoke(
+                EndpointName=self.endpoint_name,
+                ContentType=mime_type,
+                CustomAttributes=f"output_location=s3://{output_path}",
+                InputLocation=f"s3://{input_path}",
+            )
+            if response.get("FailureLocation"):
+                raise RuntimeError(f"Inference failed: {response['FailureLocation']}")
+            return None
+
+        input_key = f"input/{self.run_id}/{name}{input_path.suffix}"
+        output_key = f"output/{self.run_id}/{name}_output.png"
+        inference_id = f"{self.run_id}-{index:06d}"
+        self.s3.upload_file(str(input_path), self.input_bucket, input_key)
+        # 通知を取りこぼさないようにリクエストの送信前に登録する
+        if self.completion_waiter.uses_notifications:
+            self.completion_waiter.register(
+                inference_id,
+                callback=lambda result: self.on_notification(output_key, result),
+            )
+        response = self.invoke(
+            EndpointName=self.endpoint_name,
+            ContentType=mime_type,
+            CustomAttributes=f"output_location=s3://{self.output_bucket}/{output_key}",
+            InferenceId=inference_id,
+            InputLocation=f"s3://{self.input_bucket}/{input_key}",
+            # RequestTTLSeconds は 60 秒から 6 時間まで
+            RequestTTLSeconds=min(max(int(self.timeout), 60), 21600),
+        )
+        # エンドポイントに失敗の出力先（failure_path）が設定されている場合だけ返される
+        return output_key, response.get("FailureLocation")
+
+    def invoke(self, **kwargs) -> dict:
+        """レート制限付きで推論リクエストを送信し、スロットリング時は待って再試行する"""
+        backoff = self.INITIAL_BACKOFF_SECONDS
+        for attempt in range(self.MAX_SUBMIT_ATTEMPTS):
+            self.rate_limiter.acquire()
+            try:
+                return self.sagemaker_client.invoke_endpoint_async(**kwargs)
+            except ThrottlingError:
+                if attempt == self.MAX_SUBMIT_ATTEMPTS - 1:
+                    raise
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def on_notification(self, output_key: str, result: dict) -> None:
+        """完了通知を受け取る（受信スレッドから呼ばれる）"""
+        with self.notified_lock:
+            self.notified[output_key] = result
+        self.notified_event.set()
+
+    def wait_for_outputs(
+        self, pending: dict, failure_locations: dict, executor: ThreadPoolExecutor
+    ) -> list:
+        """
+        完了通知と出力プレフィックスの一覧で完了を判定し、完了した結果をダウンロードする
+
+        通知を受信している場合、一覧は取りこぼしの確認のために間隔を空けて行う。
+        失敗した推論は、失敗の出力先のプレフィックスの一覧で検知し、期限を待たずに失敗とする。
+
+        Args:
+            pending: 出力の S3 キー -> (入力画像のパス, ローカル出力先のパス)
+            failure_locations: 失敗の出力先の S3 URI -> 出力の S3 キー
+        Returns:
+            list: 失敗した、期限内に完了しなかった、またはダウンロードに失敗した入力画像のパス
+        """
+        prefix = f"output/{self.run_id}/"
+        deadline = time.monotonic() + self.timeout
+        paginator = self.s3.get_paginator("list_objects_v2")
+        listing_interval = self.poll_interval
+        if self.completion_waiter.uses_notifications:
+            listing_interval *= self.LISTING_INTERVAL_FACTOR
+        next_listing = time.monotonic()
+        downloads = {}
+        failed = []
+
+        while pending and time.monotonic() < deadline:
+            # 通知で完了したリクエスト
+            with self.notified_lock:
+                notified, self.notified = self.notified, {}
+            for output_key, result in notified.items():
+                paths = pending.pop(output_key, None)
+                if not paths:
+                    continue
+                if result["Status"] == "Completed":
+                    downloads[executor.submit(self.download, output_key, paths[1])] = (
+                        paths[0]
+                    )
+                else:
+                    self.logger.error(
+                        f"Inference failed for {paths[0]}: {result['FailureReason']}"
+                    )
+                    failed.append(paths[0])
+
+            # 出力プレフィックスの一覧で完了したリクエスト
+            if pending and time.monotonic() >= next_listing:
+                for page in paginator.paginate(
+                    Bucket=self.output_bucket, Prefix=prefix
+                ):
+                    for obj in page.get("Contents", []):
+                        paths = pending.pop(obj["Key"], None)
+                        if paths:
+                            downloads[
+                                executor.submit(self.download, obj["Key"], paths[1])
+                            ] = paths[0]
+                # 失敗の出力先の一覧で失敗したリクエスト
+                for output_key in self.list_failures(failure_locations):
+                    paths = pending.pop(output_key, None)
+                    if paths:
+                        self.logger.error(f"Inference failed for {paths[0]}")
+                        failed.append(paths[0])
+                next_listing = time.monotonic() + listing_interval
+                self.logger.info(
+                    f"Waiting for {len(pending)} outputs "
+                    f"({len(downloads)} completed, {len(failed)} failed)"
+                )
+
+            if pending:
+                self.notified_event.wait(
+                    max(0.0, min(self.poll_interval, deadline - time.monotonic()))
+                )
+                self.notified_event.clear()
+
+        for input_path, _ in pending.values():
+            self.logger.error(f"Output not found before the timeout: {input_path}")
+            failed.append(input_path)
+        for future in as_completed(downloads):
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.error(f"Failed to download result: {str(e)}")
+                failed.append(downloads[future])
+        return failed
+
+    def list_failures(self, failure_locations: dict) -> list:
+        """
+        失敗の出力先に書き込まれたリクエストを探す
+
+        見つかったリクエストは failure_locations から取り除く。
+
+        Returns:
+            list: 失敗したリクエストの出力の S3 キー
+        """
+        prefixes = set()
+        for location in failure_locations:
+            bucket, _, key = location[len("s3://") :].partition("/")
+            prefixes.add((bucket, key.rsplit("/", 1)[0] + "/" if "/" in key else ""))
+
+        paginator = self.s3.get_paginator("list_objects_v2")
+        failed = []
+        for bucket, prefix in prefixes:
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    output_key = failure_locations.pop(
+                        f"s3://{bucket}/{obj['Key']}", None
+                    )
+                    if output_key:
+                        failed.append(output_key)
+        return failed
+
+    def download(self, output_key: str, output_path: Path) -> None:
+        """結果をダウンロードする"""
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.s3.download_file(self.output_bucket, output_key, str(output_path))
+
+
+def request_bulk_background_removal(
+    source: str,
+    output_dir: str = "outputs",
+    concurrency: int = 16,
+    rate: float = 10.0,
+    timeout: float = 3600.0,
+) -> bool:
+    """
+    ディレクトリまたはマニフェストの画像をまとめて背景除去する
+
+    Args:
+        source: 入力ディレクトリ、またはマニフェストファイル（1 行に 1 つの画像パス）
+        output_dir: 出力ディレクトリ（デフォルト: "outputs"）
+        concurrency: 並列にアップロード・リクエストするスレッド数
+        rate: 1 秒あたりの推論リクエスト数の上限（0 以下で無制限）
+        timeout: 全リクエストの完了を待つ最大秒数
+    Returns:
+        bool: すべての画像の処理が成功したかどうか
+    """
+    inputs = collect_inputs(source, output_dir)
+    if not inputs:
+        logger.error(f"No input images found in {source}")
+        return False
+
+    bulk = BulkBackgroundRemoval(concurrency=concurrency, rate=rate, timeout=timeout)
+    failed = bulk.run(inputs)
+    for input_path in failed:
+        logger.error(f"Failed: {input_path}")
+    return not failed
+
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="背景除去リクエストを送信")
-    parser.add_argument("input_image", help="入力画像のパス")
+    parser.add_argument(
+        "input_image",
+        help="入力画像のパス（--bulk の場合はディレクトリまたはマニフェストファイル）",
+    )
     parser.add_argument(
         "--output-dir",
         default="local-bucket/outputs",
         help="出力ディレクトリ（デフォルト: local-bucket/outputs）",
     )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="ディレクトリまたはマニフェストの画像をまとめて処理する",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="一括処理の並列数（デフォルト: 16）",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10.0,
+        help="一括処理の 1 秒あたりのリクエスト数の上限（デフォルト: 10、0 で無制限）",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3600.0,
+        help="一括処理の完了を待つ最大秒数（デフォルト: 3600）",
+    )
 
     args = parser.parse_args()
-    success = request_background_removal(args.input_image, args.output_dir)
+    if args.bulk:
+        success = request_bulk_background_removal(
+            args.input_image,
+            args.output_dir,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            timeout=args.timeout,
+        )
+    else:
+        success = request_background_removal(args.input_image, args.output_dir)
 
     if not success:
         exit(1)
@@ -0,0 +1,100 @@
+import io
+import logging
+import os
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# EXIF orientation tag and the orientations that swap width and height
+ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def parse_size(value: Optional[str]) -> Optional[tuple]:
+    """Parse "WxH" into (width, height); empty values disable the limit"""
+    if not value:
+        return None
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+class ResolutionPolicy:
+    """Decides the resolution at which inputs are decoded, masked and returned
+
+    - ``max_output_size``: outputs are downscaled to fit in this (width, height)
+      box, keeping the aspect ratio. Large JPEG inputs are decoded in draft mode
+      at the smallest DCT scale that still covers the box, so the full-resolution
+      pixels are never decoded. The box is taken after EXIF orientation, i.e. it
+      is swapped for the stored image when the orientation transposes it.
+    - ``lowres_mask``: the mask is predicted at low resolution and upsampled
+      bilinearly while it is applied to the full-resolution image, through the
+      tiled path for single images, instead of rembg's LANCZOS-resized
+      full-resolution mask.
+    """
+
+    def __init__(
+        self,
+        max_output_size: Optional[tuple] = None,
+        lowres_mask: Optional[bool] = None,
+        draft_decode: Optional[bool] = None,
+    ):
+        self.max_output_size = (
+            max_output_size
+            if max_output_size is not None
+            else parse_size(os.environ.get("MAX_OUTPUT_SIZE"))
+        )
+        self.lowres_mask = (
+            lowres_mask
+            if lowres_mask is not None
+            else os.environ.get("LOWRES_MASK", "false").lower() == "true"
+        )
+        self.draft_decode = (
+            draft_decode
+            if draft_decode is not None
+            else os.environ.get("JPEG_DRAFT_DECODE", "true").lower() == "true"
+        )
+
+    def settings(self) -> str:
+        """Policy settings that determine the output produced for an input"""
+        max_output_size = (
+            "x".join(str(side) for side in self.max_output_size)
+            if self.max_output_size
+            else "none"
+        )
+        # Draft decoding changes the decoded pixels, so it is part of the cache key
+        return (
+            f"max_output_size={max_output_size},lowres_mask={self.lowres_mask},"
+            f"draft_decode={self.draft_decode}"
+        )
+
+    def decode(self, image_data: bytes) -> Image.Image:
+        """Decode an input image at the resolution the policy needs"""
+        image = Image.open(io.BytesIO(image_data))
+        if not self.max_output_size:
+            image.load()
+            return image
+
+        original_size = image.size
+        if self.draft_decode and image.format == "JPEG":
+            # draft keeps every side at or above the requested size
+            image.draft(image.mode, self._stored_box(image))
+        image.load()
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(self.max_output_size)
+        if image.size != original_size:
+            logger.debug(f"Input downscaled from {original_size} to {image.size}")
+        return image
+
+    def _stored_box(self, image: Image.Image) -> tuple:
+        """Output box in the orientation of the stored pixels"""
+        width, height = self.max_output_size
+        orientation = image.getexif().get(ORIENTATION_TAG)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            return height, width
+        return width, height
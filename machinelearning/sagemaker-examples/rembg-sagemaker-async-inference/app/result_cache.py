@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def cache_key(image_data: bytes, model_name: str, output_options: str) -> str:
+    """Content address of a result: the input bytes, the model and the output options"""
+    sha256 = hashlib.sha256(image_data)
+    sha256.update(f"\0{model_name}\0{output_options}".encode())
+    return sha256.hexdigest()
+
+
+class ResultCache:
+    """Content-addressed cache of encoded inference outputs
+
+    Results are looked up in an in-memory LRU tier bounded by
+    ``max_memory_bytes``, then in an optional local-disk tier bounded by
+    ``max_disk_bytes`` (least recently used entries are evicted). An optional
+    S3 tier keeps results under ``s3_location``; S3 hits are served with a
+    server-side copy so the output bytes never pass through the container.
+    Errors from the disk and S3 tiers are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 0,
+        s3_client=None,
+        s3_location: Optional[str] = None,
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self.s3 = s3_client
+        self.s3_bucket = None
+        self.s3_prefix = ""
+        if s3_client is not None and s3_location:
+            if not s3_location.startswith("s3://"):
+                raise ValueError("RESULT_CACHE_S3_LOCATION must be an S3 URI (s3://)")
+            bucket, _, prefix = s3_location[len("s3://") :].partition("/")
+            self.s3_bucket = bucket
+            self.s3_prefix = prefix.strip("/")
+        self._entries: OrderedDict = OrderedDict()
+        self._memory_bytes = 0
+        # Disk entries (key -> size) in least recently used order
+        self._disk_entries: OrderedDict = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_entries()
+
+    @property
+    def uses_s3(self) -> bool:
+        return self.s3_bucket is not None
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (output bytes, content type) from the memory or disk tier"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                output_bytes = path.read_bytes()
+                content_type = path.with_suffix(".type").read_text()
+            except FileNotFoundError:
+                return None
+            except OSError as e:
+                logger.warning(f"Could not read result cache entry {key}: {str(e)}")
+                return None
+            with self._lock:
+                if key in self._disk_entries:
+                    self._disk_entries.move_to_end(key)
+            self._remember(key, output_bytes, content_type)
+            return output_bytes, content_type
+        return None
+
+    def put(self, key: str, output_bytes: bytes, content_type: str) -> None:
+        """Store a result in the memory and disk tiers"""
+        self._remember(key, output_bytes, content_type)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.with_suffix(".type").write_text(content_type)
+                # Write to a temporary file so readers never see a partial result
+                tmp_path = path.with_suffix(f".{threading.get_ident()}.part")
+                tmp_path.write_bytes(output_bytes)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not write result cache entry {key}: {str(e)}")
+                return
+            self._track_disk_entry(key, len(output_bytes))
+
+    def copy_from_s3(self, key: str, output_bucket: str, output_key: str) -> bool:
+        """Server-side copy a cached result to the output location, if it exists
+
+        Any S3 error (not found, access denied, throttling) counts as a miss, so
+        the caller falls through to inference.
+        """
+        try:
+            self.s3.copy_object(
+                CopySource={"Bucket": self.s3_bucket, "Key": self._s3_key(key)},
+                Bucket=output_bucket,
+                Key=output_key,
+            )
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            logger.warning(f"Could not read result cache entry {key} from S3: {str(e)}")
+            return False
+        except Exception as e:
+            logger.warning(f"Could not read result cache entry {key} from S3: {str(e)}")
+            return False
+
+    def store_to_s3(self, key: str, output_bucket: str, output_key: str) -> None:
+        """Server-side copy an uploaded output into the S3 tier"""
+        try:
+            self.s3.copy_object(
+                CopySource={"Bucket": output_bucket, "Key": output_key},
+                Bucket=self.s3_bucket,
+                Key=self._s3_key(key),
+            )
+        except Exception as e:
+            logger.warning(f"Could not store result cache entry {key} in S3: {str(e)}")
+
+    def _remember(self, key: str, output_bytes: bytes, content_type: str) -> None:
+        if len(output_bytes) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (output_bytes, content_type)
+            self._memory_bytes += len(output_bytes)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _load_disk_entries(self) -> None:
+        """Index entries left by a previous run, oldest first, and apply the budget"""
+        entries = []
+        for path in self.disk_dir.glob("*/*.bin"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_entries[key] = size
+            self._disk_bytes += size
+        self._evict_disk_entries()
+
+    def _track_disk_entry(self, key: str, size: int) -> None:
+        with self._lock:
+            self._disk_bytes += size - self._disk_entries.pop(key, 0)
+            self._disk_entries[key] = size
+        self._evict_disk_entries()
+
+    def _evict_disk_entries(self) -> None:
+        if self.max_disk_bytes <= 0:
+            return
+        evicted = []
+        with self._lock:
+            while self._disk_bytes > self.max_disk_bytes and self._disk_entries:
+                key, size = self._disk_entries.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(key)
+        for key in evicted:
+            path = self._disk_path(key)
+            for stale in (path, path.with_suffix(".type")):
+                try:
+                    stale.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(
+                        f"Could not evict result cache entry {key}: {str(e)}"
+                    )
+
+    def _disk_path(self, key: str) -> Path:
+        # Fan out by key prefix to keep directories small
+        return self.disk_dir / key[:2] / f"{key}.bin"
+
+    def _s3_key(self, key: str) -> str:
+        return f"{self.s3_prefix}/{key}" if self.s3_prefix else key
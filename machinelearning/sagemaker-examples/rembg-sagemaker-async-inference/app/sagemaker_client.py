@@ -5,7 +5,11 @@ import time
 import boto3
 import requests
 import logging
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List
 
 # ロガーの設定
 logging.basicConfig(
@@ -14,14 +18,60 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class ThrottlingError(RuntimeError):
+    """エンドポイントのキューが満杯でリクエストが拒否された場合のエラー（再試行できる）"""
+
+
 class SageMakerClient:
     """SageMaker関連の操作を担当するクラス"""
 
-    def __init__(self):
-        """boto3クライアントの初期化"""
-        self.sagemaker = boto3.client("sagemaker-runtime")
+    def __init__(self, max_pool_connections: int = 10):
+        """boto3クライアントの初期化
+
+        Args:
+            max_pool_connections: 並列にリクエストを送る場合のコネクションプールサイズ
+        """
+        self.max_pool_connections = max_pool_connections
+        self.sagemaker = boto3.client(
+            "sagemaker-runtime",
+            config=Config(
+                max_pool_connections=max_pool_connections,
+                retries={"mode": "adaptive"},
+            ),
+        )
+        # ローカル環境ではコネクションを再利用するセッションでリクエストを送る
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_pool_connections, pool_block=True
+        )
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def invoke_endpoint_async_many(
+        self, requests_kwargs: List[Dict[str, Any]], max_workers: int = None
+    ) -> List[Any]:
+        """
+        複数の invoke_endpoint_async を並列に実行する
+
+        Args:
+            requests_kwargs: invoke_endpoint_async の引数のリスト
+            max_workers: 並列数（デフォルト: コネクションプールサイズ）
+        Returns:
+            List[Any]: 引数と同じ順のレスポンス。失敗したリクエストは例外オブジェクト
+        """
+
+        def invoke(kwargs: Dict[str, Any]) -> Any:
+            try:
+                return self.invoke_endpoint_async(**kwargs)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers or self.max_pool_connections
+        ) as executor:
+            return list(executor.map(invoke, requests_kwargs))
+
     def invoke_endpoint_async(
         self,
         EndpointName: str,
@@ -35,7 +85,11 @@ class SageMakerClient:
     ) -> Dict[str, Any]:
         """
         invoke_endpoint_asyncのラッパーメソッド
-        ローカル環境の場合はrequests.postに変換する
+        ローカル環境の場合はプールされた requests.Session での POST に変換し、
+        入力ファイルはメモリに読み込まずにストリーミングで送信する
+
+        Raises:
+            ThrottlingError: スロットリングされた場合（AWS・ローカルとも）
 
         Returns:
             Dict[str, Any]: {
@@ -45,16 +99,21 @@ class SageMakerClient:
             }
         """
         if os.getenv("USE_AWS", "false").lower() == "true":
-            return self.sagemaker.invoke_endpoint_async(
-                EndpointName=EndpointName,
-                ContentType=ContentType,
-                Accept=Accept,
-                CustomAttributes=CustomAttributes,
-                InferenceId=InferenceId,
-                InputLocation=InputLocation,
-                RequestTTLSeconds=RequestTTLSeconds,
-                InvocationTimeoutSeconds=InvocationTimeoutSeconds,
-            )
+            try:
+                return self.sagemaker.invoke_endpoint_async(
+                    EndpointName=EndpointName,
+                    ContentType=ContentType,
+                    Accept=Accept,
+                    CustomAttributes=CustomAttributes,
+                    InferenceId=InferenceId,
+                    InputLocation=InputLocation,
+                    RequestTTLSeconds=RequestTTLSeconds,
+                    InvocationTimeoutSeconds=InvocationTimeoutSeconds,
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") == "ThrottlingException":
+                    raise ThrottlingError(str(e)) from e
+                raise
         else:
             # ローカル環境用の実装
             if not InputLocation:
@@ -75,6 +134,18 @@ class SageMakerClient:
             url = f"http://{endpoint_host}/invocations"
             headers = {"Content-Type": ContentType}
 
+            # InvocationTimeoutSeconds はカスタム属性としてコンテナに渡し、
+            # キュー内のリクエストの期限として使う
+            if InvocationTimeoutSeconds:
+                timeout_attribute = (
+                    f"invocation_timeout_seconds={InvocationTimeoutSeconds}"
+                )
+                CustomAttributes = (
+                    f"{CustomAttributes};{timeout_attribute}"
+                    if CustomAttributes
+                    else timeout_attribute
+                )
+
             # Add optional headers
             if Accept:
                 headers["X-Amzn-SageMaker-Accept"] = Accept
@@ -87,18 +158,19 @@ class SageMakerClient:
             self.logger.info(f"URL: {url}")
             self.logger.info(f"Headers: {json.dumps(headers, indent=2)}")
 
-            # Convert s3:// path to local path and read image as binary
+            # Convert s3:// path to local path and stream the image file as the body
             local_path = InputLocation.replace("s3://", "")
             try:
-                with open(local_path, "rb") as f:
-                    body = f.read()
+                body = open(local_path, "rb")
             except FileNotFoundError:
                 raise ValueError(f"Image file not found at {local_path}")
             except IOError as e:
                 raise ValueError(f"Error reading image file: {str(e)}")
 
             try:
-                response = requests.post(url, headers=headers, data=body)
+                # ファイルオブジェクトを渡すとメモリに読み込まずに送信される
+                with body:
+                    response = self.http.post(url, headers=headers, data=body)
 
                 if response.status_code == 202:
                     # Extract response headers
@@ -126,6 +198,8 @@ class SageMakerClient:
 
                 elif response.status_code == 400:
                     raise ValueError("ValidationError: Invalid request parameters")
+                elif response.status_code == 429:
+                    raise ThrottlingError("ThrottlingException: The queue is full")
                 elif response.status_code == 500:
                     raise RuntimeError("InternalFailure: An internal error occurred")
                 elif response.status_code == 503:
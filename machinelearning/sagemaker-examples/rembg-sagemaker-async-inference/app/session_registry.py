@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+from rembg_handler import RembgHandler
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+model_dir_path = os.environ.get("MODEL_PATH", "/opt/ml/model")
+
+# Loaded ONNX Runtime sessions take more memory than the model file itself
+SESSION_MEMORY_FACTOR = 1.5
+# Size assumed for models whose file is not available locally
+DEFAULT_MODEL_SIZE_MB = 200
+
+
+def _parse_model_list(value: str) -> list:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def configured_models() -> list:
+    """Model names that requests may select, from AVAILABLE_MODELS"""
+    default_model = os.environ.get("MODEL_NAME", "u2net")
+    models = _parse_model_list(os.environ.get("AVAILABLE_MODELS", default_model))
+    if default_model not in models:
+        models.insert(0, default_model)
+    return models
+
+
+class SessionRegistry:
+    """RembgHandler per model name, loaded lazily and evicted in LRU order
+
+    The estimated memory of all loaded sessions is kept under
+    ``memory_budget_mb`` by evicting the least recently used handlers.
+    Pinned models are loaded up front and never evicted.
+    """
+
+    def __init__(
+        self,
+        available_models: Optional[list] = None,
+        memory_budget_mb: Optional[float] = None,
+        pinned_models: Optional[list] = None,
+        handler_factory: Callable[[str], RembgHandler] = RembgHandler,
+    ):
+        self.available_models = available_models or configured_models()
+        self.memory_budget_mb = (
+            memory_budget_mb
+            if memory_budget_mb is not None
+            else float(os.environ.get("SESSION_MEMORY_BUDGET_MB", "4096"))
+        )
+        self.pinned_models = set(
+            pinned_models
+            if pinned_models is not None
+            else _parse_model_list(
+                os.environ.get("PINNED_MODELS", os.environ.get("MODEL_NAME", "u2net"))
+            )
+        )
+        self.handler_factory = handler_factory
+        self._handlers: OrderedDict = OrderedDict()
+        self._sizes: dict = {}
+        self._lock = threading.Lock()
+        self._load_locks: dict = {}
+
+    @property
+    def loaded_models(self) -> list:
+        """Loaded model names, least recently used first"""
+        return list(self._handlers.keys())
+
+    @property
+    def used_memory_mb(self) -> float:
+        return sum(self._sizes.values())
+
+    def preload(self) -> None:
+        """Load all pinned models"""
+        for model_name in self.pinned_models:
+            self.get(model_name)
+
+    def get(self, model_name: str) -> RembgHandler:
+        """Return the handler for a model, loading it if necessary"""
+        if model_name not in self.available_models:
+            raise ValueError(
+                f"Unknown model: {model_name}. Available models: {self.available_models}"
+            )
+
+        with self._lock:
+            if model_name in self._handlers:
+                self._handlers.move_to_end(model_name)
+                return self._handlers[model_name]
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+
+        # Serialize construction per model without blocking lookups of other models
+        with load_lock:
+            with self._lock:
+                if model_name in self._handlers:
+                    self._handlers.move_to_end(model_name)
+                    return self._handlers[model_name]
+                size_mb = self._estimate_size_mb(model_name)
+                self._evict(size_mb)
+
+            logger.info(f"Loading session for {model_name} (~{size_mb:.0f} MB)")
+            handler = self.handler_factory(model_name)
+
+            with self._lock:
+                self._handlers[model_name] = handler
+                self._sizes[model_name] = size_mb
+                logger.info(
+                    f"Loaded models: {self.loaded_models}, estimated memory: "
+                    f"{self.used_memory_mb:.0f}/{self.memory_budget_mb:.0f} MB"
+                )
+            return handler
+
+    def _evict(self, required_mb: float) -> None:
+        """Evict unpinned handlers until the new session fits in the budget"""
+        for model_name in list(self._handlers.keys()):
+            if self.used_memory_mb + required_mb <= self.memory_budget_mb:
+                return
+            if model_name in self.pinned_models:
+                continue
+            logger.info(f"Evicting session for {model_name}")
+            del self._handlers[model_name]
+            del self._sizes[model_name]
+
+        if self.used_memory_mb + required_mb > self.memory_budget_mb:
+            logger.warning(
+                f"Memory budget of {self.memory_budget_mb:.0f} MB exceeded by pinned "
+                f"models; loading anyway"
+            )
+
+    def _estimate_size_mb(self, model_name: str) -> float:
+        model_path = Path(model_dir_path) / f"{model_name}.onnx"
+        if model_path.exists():
+            file_size_mb = model_path.stat().st_size / (1024 * 1024)
+        else:
+            file_size_mb = DEFAULT_MODEL_SIZE_MB
+        return file_size_mb * SESSION_MEMORY_FACTOR
@@ -58,7 +58,18 @@ uv sync
 if [ "$SKIP_MODEL_UPLOAD" = "false" ]; then
     # モデルファイルの準備とアップロード
     echo "モデルファイルをtar.gzに圧縮します..."
-    tar -czf model.tar.gz -C models u2net.onnx
+    # AVAILABLE_MODELS（未設定時は MODEL_NAME）のモデルをすべて含める
+    MODEL_FILES=""
+    for MODEL in $(echo "${AVAILABLE_MODELS:-${MODEL_NAME:-u2net}}" | tr ',' '\n' | sed 's/ //g; /^$/d'); do
+        MODEL_FILES="$MODEL_FILES $MODEL.onnx"
+        # 推論サーバーがロード前に検証できるよう、download_models.py が作成したチェックサムも含める
+        if [ -f "models/$MODEL.onnx.sha256" ]; then
+            MODEL_FILES="$MODEL_FILES $MODEL.onnx.sha256"
+        else
+            echo "警告: models/$MODEL.onnx.sha256 がありません。download_models.py を実行するとチェックサムが作成されます"
+        fi
+    done
+    tar -czf model.tar.gz -C models $MODEL_FILES
     echo "model.tar.gz を作成しました"
 
     # S3にアップロード
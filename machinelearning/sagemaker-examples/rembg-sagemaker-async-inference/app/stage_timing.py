@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed buckets"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        for i, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                self.counts[i] += 1
+                break
+
+
+class StageMetrics:
+    """Per-stage latency histograms, rendered in the Prometheus text format"""
+
+    def __init__(self, metric_name: str = "rembg_stage_duration_seconds"):
+        self.metric_name = metric_name
+        self._histograms: dict = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def render_prometheus(self) -> str:
+        lines = [
+            f"# HELP {self.metric_name} Latency of each request processing stage",
+            f"# TYPE {self.metric_name} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for upper_bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'{self.metric_name}_bucket{{stage="{stage}",le="{upper_bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'{self.metric_name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}'
+                )
+                lines.append(
+                    f'{self.metric_name}_sum{{stage="{stage}"}} {histogram.sum:.6f}'
+                )
+                lines.append(
+                    f'{self.metric_name}_count{{stage="{stage}"}} {histogram.count}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+class RequestTiming:
+    """Stage durations of a single request
+
+    Only a ``sample_rate`` fraction of requests is timed; for the others every
+    method is a no-op so the instrumentation costs next to nothing.
+    """
+
+    def __init__(self, metrics: StageMetrics, sample_rate: float = 1.0):
+        self.metrics = metrics
+        self.sampled = random.random() < sample_rate
+        self.stages: dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as ``name``"""
+        if not self.sampled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        if self.sampled:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_all(self, stages: Optional[dict]) -> None:
+        for name, seconds in (stages or {}).items():
+            self.record(name, seconds)
+
+    def finish(self) -> None:
+        """Add the recorded stages to the histograms"""
+        for name, seconds in self.stages.items():
+            self.metrics.observe(name, seconds)
+
+    def server_timing_header(self) -> Optional[str]:
+        """Stage durations as a Server-Timing header value, in milliseconds"""
+        if not self.stages:
+            return None
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()
+        )
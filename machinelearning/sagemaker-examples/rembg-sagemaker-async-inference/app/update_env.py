@@ -20,11 +20,13 @@ def update_env():
         "USE_GPU": "false",
         "MAX_CONCURRENT_INVOCATIONS": "4",
         "MODEL_NAME": "u2net",
+        "AVAILABLE_MODELS": "u2net",  # カスタム属性 model= で選択できるモデル（カンマ区切り）
         "MODEL_PATH": "/opt/ml/model",
         "INPUT_BUCKET": "",  # CDKで生成される
         "OUTPUT_BUCKET": "",  # CDKで生成される
         "SUCCESS_TOPIC_ARN": "",  # CDKで生成される
         "ERROR_TOPIC_ARN": "",  # CDKで生成される
+        "NOTIFICATION_QUEUE_URL": "",  # CDKで生成される（SNS トピックを購読する SQS キュー）
         "MODEL_DATA_URL": "",  # {INPUT_BUCKET}/models/model.tar.gz として設定される
         "LOCAL_ENDPOINT_HOST": "localhost:8080",
     }
@@ -64,6 +66,9 @@ def update_env():
             if "NotificationTopicArn" in stack_outputs:
                 env_vars["SUCCESS_TOPIC_ARN"] = stack_outputs["NotificationTopicArn"]
                 env_vars["ERROR_TOPIC_ARN"] = stack_outputs["NotificationTopicArn"]
+            # NotificationQueueUrlを設定
+            if "NotificationQueueUrl" in stack_outputs:
+                env_vars["NOTIFICATION_QUEUE_URL"] = stack_outputs["NotificationQueueUrl"]
             # S3バケット名を設定
             if "InputBucketName" in stack_outputs:
                 env_vars["INPUT_BUCKET"] = stack_outputs["InputBucketName"]
@@ -115,6 +120,9 @@ def update_env():
         f.write(f"SUCCESS_TOPIC_ARN={env_vars['SUCCESS_TOPIC_ARN']}\n")
         f.write(f"ERROR_TOPIC_ARN={env_vars['ERROR_TOPIC_ARN']}\n\n")
 
+        f.write("# SQS Queue\n")
+        f.write(f"NOTIFICATION_QUEUE_URL={env_vars['NOTIFICATION_QUEUE_URL']}\n\n")
+
         f.write("# Runtime Configuration\n")
         f.write(f"USE_AWS={env_vars['USE_AWS']}\n")
         f.write(f"USE_GPU={env_vars['USE_GPU']}\n")
@@ -122,6 +130,7 @@ def update_env():
             f"MAX_CONCURRENT_INVOCATIONS={env_vars['MAX_CONCURRENT_INVOCATIONS']}\n"
         )
         f.write(f"MODEL_NAME={env_vars['MODEL_NAME']}\n")
+        f.write(f"AVAILABLE_MODELS={env_vars['AVAILABLE_MODELS']}\n")
         f.write(f"MODEL_PATH={env_vars['MODEL_PATH']}\n")
         f.write(f"MODEL_DATA_URL={env_vars['MODEL_DATA_URL']}\n\n")
 
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue has no free slot"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a work item expires before or during processing"""
+
+
+class WorkItem:
+    """A queued unit of work with the deadline it must finish by"""
+
+    def __init__(self, payload: Any, deadline: float, future: asyncio.Future):
+        self.payload = payload
+        self.deadline = deadline
+        self.future = future
+
+
+class AdmissionQueue:
+    """Bounded asyncio work queue served by a fixed number of workers
+
+    ``max_depth`` bounds the number of items waiting for a worker, so requests
+    are only rejected once both the workers and the queue are full. Each item
+    carries a deadline on the event loop clock; expired items are dropped
+    before they reach a worker and running items are cancelled when their
+    deadline passes.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        num_workers: int = 2,
+        max_depth: int = 16,
+    ):
+        self.handler = handler
+        self.num_workers = max(1, num_workers)
+        self.max_depth = max(1, max_depth)
+        self.in_flight = 0
+        # Items the handler has finished, successfully or not
+        self.completed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list = []
+
+    @property
+    def queued(self) -> int:
+        """Number of items waiting for a worker"""
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def depth(self) -> int:
+        """Number of items queued or being processed"""
+        return self.queued + self.in_flight
+
+    def start(self) -> None:
+        """Start the workers on the running event loop"""
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.num_workers)
+        ]
+        logger.info(
+            f"Admission queue started: workers={self.num_workers}, "
+            f"max_depth={self.max_depth}"
+        )
+
+    async def stop(self) -> None:
+        """Cancel the workers"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, payload: Any, deadline: float) -> Any:
+        """Enqueue a payload and wait for the handler result
+
+        Raises:
+            QueueFullError: if the queue is at its maximum depth
+            DeadlineExceededError: if the deadline passes before completion
+        """
+        if self._queue is None:
+            raise RuntimeError("Admission queue is not running")
+        loop = asyncio.get_running_loop()
+        item = WorkItem(payload, deadline, loop.create_future())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Queue depth limit reached: {self.max_depth}")
+        return await item.future
+
+    async def _worker(self, worker_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            try:
+                if item.future.done():
+                    # The caller went away while the item was queued
+                    continue
+                remaining = item.deadline - loop.time()
+                if remaining <= 0:
+                    logger.warning(f"Dropping expired work item (worker {worker_id})")
+                    item.future.set_exception(
+                        DeadlineExceededError("Deadline expired while queued")
+                    )
+                    continue
+
+                self.in_flight += 1
+                try:
+                    result = await asyncio.wait_for(
+                        self.handler(item.payload), remaining
+                    )
+                    if not item.future.done():
+                        item.future.set_result(result)
+                except asyncio.TimeoutError:
+                    if not item.future.done():
+                        item.future.set_exception(
+                            DeadlineExceededError("Deadline expired while processing")
+                        )
+                except Exception as e:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                finally:
+                    self.in_flight -= 1
+                    self.completed += 1
+            finally:
+                self._queue.task_done()
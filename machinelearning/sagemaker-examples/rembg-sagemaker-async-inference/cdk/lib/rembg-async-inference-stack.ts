@@ -3,6 +3,8 @@ import * as s3 from 'aws-cdk-lib/aws-s3';
 import * as ecr from 'aws-cdk-lib/aws-ecr';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as sns from 'aws-cdk-lib/aws-sns';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as subscriptions from 'aws-cdk-lib/aws-sns-subscriptions';
 import { Construct } from 'constructs';
 
 export class RembgAsyncInferenceStack extends cdk.Stack {
@@ -46,6 +48,15 @@ export class RembgAsyncInferenceStack extends cdk.Stack {
       displayName: 'Rembg Async Inference Notifications'
     });
 
+    // Create SQS queue so clients can receive completion notifications
+    const notificationQueue = new sqs.Queue(this, 'AsyncInferenceNotificationQueue', {
+      retentionPeriod: cdk.Duration.days(1),
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    notificationTopic.addSubscription(new subscriptions.SqsSubscription(notificationQueue, {
+      rawMessageDelivery: true
+    }));
+
     // Create SageMaker execution role
     const sagemakerRole = new iam.Role(this, 'SageMakerExecutionRole', {
       assumedBy: new iam.ServicePrincipal('sagemaker.amazonaws.com'),
@@ -135,5 +146,10 @@ export class RembgAsyncInferenceStack extends cdk.Stack {
       value: notificationTopic.topicArn,
       description: 'ARN of the SNS notification topic'
     });
+
+    new cdk.CfnOutput(this, 'NotificationQueueUrl', {
+      value: notificationQueue.queueUrl,
+      description: 'URL of the SQS queue subscribed to the notification topic'
+    });
   }
 }
\ No newline at end of file
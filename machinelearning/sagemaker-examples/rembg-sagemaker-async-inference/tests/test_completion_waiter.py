@@ -0,0 +1,225 @@
+import itertools
+import json
+import threading
+import time
+
+import pytest
+
+from completion_waiter import CompletionWaiter
+
+QUEUE_URL = "https://sqs.local/000000000000/notifications"
+
+
+class LocalSQS:
+    """CompletionWaiter が使う SQS の API だけを実装したメモリ上のキュー"""
+
+    VISIBILITY_TIMEOUT = 30.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # メッセージ ID -> {"Body", "ReceiptHandle", "VisibleAt"}
+        self.messages = {}
+        self.ids = itertools.count()
+
+    def send(self, body: str) -> None:
+        with self.lock:
+            message_id = str(next(self.ids))
+            self.messages[message_id] = {
+                "Body": body,
+                "ReceiptHandle": None,
+                "VisibleAt": 0.0,
+            }
+
+    def bodies(self) -> list:
+        """削除されていないメッセージの本文"""
+        with self.lock:
+            return sorted(m["Body"] for m in self.messages.values())
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0):
+        # ロングポーリングの代わりに短く待つ
+        deadline = time.monotonic() + min(WaitTimeSeconds, 0.05)
+        while True:
+            now = time.monotonic()
+            received = []
+            with self.lock:
+                for message_id, message in self.messages.items():
+                    if message["VisibleAt"] > now:
+                        continue
+                    message["ReceiptHandle"] = f"{message_id}-{next(self.ids)}"
+                    message["VisibleAt"] = now + self.VISIBILITY_TIMEOUT
+                    received.append(
+                        {
+                            "MessageId": message_id,
+                            "ReceiptHandle": message["ReceiptHandle"],
+                            "Body": message["Body"],
+                        }
+                    )
+                    if len(received) >= MaxNumberOfMessages:
+                        break
+            if received or now >= deadline:
+                return {"Messages": received} if received else {}
+            time.sleep(0.005)
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        with self.lock:
+            for entry in Entries:
+                message_id = self._find(entry["ReceiptHandle"])
+                if message_id is not None:
+                    del self.messages[message_id]
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        with self.lock:
+            for entry in Entries:
+                message_id = self._find(entry["ReceiptHandle"])
+                if message_id is not None:
+                    self.messages[message_id]["VisibleAt"] = (
+                        time.monotonic() + entry["VisibilityTimeout"]
+                    )
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def _find(self, receipt_handle: str):
+        for message_id, message in self.messages.items():
+            if message["ReceiptHandle"] == receipt_handle:
+                return message_id
+        return None
+
+
+class CountingS3:
+    """head_object の呼び出し回数を数える S3 クライアント"""
+
+    def __init__(self):
+        self.head_calls = 0
+
+    def head_object(self, Bucket, Key):
+        self.head_calls += 1
+        return {}
+
+
+def notification(inference_id: str, status: str = "Completed") -> str:
+    """raw message delivery の非同期推論の通知"""
+    return json.dumps(
+        {
+            "inferenceId": inference_id,
+            "invocationStatus": status,
+            "responseParameters": {"outputLocation": f"s3://bucket/{inference_id}"},
+        }
+    )
+
+
+@pytest.fixture
+def sqs():
+    return LocalSQS()
+
+
+@pytest.fixture
+def s3():
+    return CountingS3()
+
+
+@pytest.fixture
+def waiter(sqs, s3):
+    waiter = CompletionWaiter(
+        queue_url=QUEUE_URL,
+        s3_client=s3,
+        sqs_client=sqs,
+        initial_poll_interval=0.01,
+    ).start()
+    yield waiter
+    waiter.stop(wait=True)
+
+
+def test_notifications_are_demultiplexed_by_inference_id(waiter, sqs):
+    waiter.register("a")
+    waiter.register("b")
+    sqs.send(notification("b", status="Failed"))
+    sqs.send(notification("a"))
+
+    assert waiter.wait("a", timeout=5)["Status"] == "Completed"
+    assert waiter.wait("b", timeout=5)["Status"] == "Failed"
+    assert sqs.bodies() == []
+
+
+def test_callback_receives_the_notification(waiter, sqs):
+    received = threading.Event()
+    results = []
+
+    def callback(result):
+        results.append(result)
+        received.set()
+
+    waiter.register("a", callback=callback)
+    sqs.send(notification("a"))
+
+    assert received.wait(5)
+    assert results[0]["OutputLocation"] == "s3://bucket/a"
+
+
+def test_early_notification_is_kept_until_registered(waiter, sqs):
+    sqs.send(notification("early"))
+    # 登録前に受信した通知は削除されず、可視性タイムアウトを待たずに再び受信される
+    time.sleep(0.1)
+    assert sqs.bodies() == [notification("early")]
+
+    waiter.register("early")
+    assert waiter.wait("early", timeout=5)["Status"] == "Completed"
+    assert sqs.bodies() == []
+
+
+def test_foreign_notifications_are_left_in_the_queue(waiter, sqs):
+    sqs.send(notification("other-client"))
+    sqs.send("not a notification")
+    waiter.register("mine")
+    sqs.send(notification("mine"))
+
+    assert waiter.wait("mine", timeout=5)["Status"] == "Completed"
+    time.sleep(0.05)
+    assert sqs.bodies() == sorted([notification("other-client"), "not a notification"])
+
+
+def test_late_notification_of_finished_wait_is_deleted(waiter, sqs):
+    assert waiter.wait("late", timeout=0.05) is None
+    sqs.send(notification("late"))
+
+    deadline = time.monotonic() + 5
+    while sqs.bodies() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sqs.bodies() == []
+
+
+def test_no_polling_while_waiting_for_notifications(waiter, sqs, s3):
+    waiter.register("a")
+    threading.Timer(0.2, sqs.send, args=(notification("a"),)).start()
+
+    result = waiter.wait("a", "bucket", "output/a.png", timeout=5)
+
+    assert result["Status"] == "Completed"
+    assert s3.head_calls == 0
+
+
+def test_polls_output_after_the_grace_period(sqs, s3):
+    waiter = CompletionWaiter(
+        queue_url=QUEUE_URL,
+        s3_client=s3,
+        sqs_client=sqs,
+        initial_poll_interval=0.01,
+        notification_grace_period=0.05,
+    ).start()
+    try:
+        result = waiter.wait("a", "bucket", "output/a.png", timeout=5)
+    finally:
+        waiter.stop(wait=True)
+
+    assert result["OutputLocation"] == "s3://bucket/output/a.png"
+    assert s3.head_calls == 1
+
+
+def test_polls_output_without_a_queue(s3, monkeypatch):
+    monkeypatch.delenv("NOTIFICATION_QUEUE_URL", raising=False)
+    waiter = CompletionWaiter(s3_client=s3, initial_poll_interval=0.01)
+
+    result = waiter.wait("a", "bucket", "output/a.png", timeout=5)
+
+    assert not waiter.uses_notifications
+    assert result["Status"] == "Completed"
+    assert s3.head_calls == 1
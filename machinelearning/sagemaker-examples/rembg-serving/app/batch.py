@@ -0,0 +1,177 @@
+import asyncio
+import functools
+import io
+import json
+import logging
+import zipfile
+from contextlib import ExitStack
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+# (ファイル名, 画像のファイルを開く関数)
+BatchInput = Tuple[str, Callable[[], BinaryIO]]
+
+
+class ZipStream:
+    """zipfile が書き込んだバイト列を溜めておき、ストリーミングレスポンスに渡す"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def is_zip(filename: str, content_type: str) -> bool:
+    return content_type in ZIP_CONTENT_TYPES or filename.lower().endswith(".zip")
+
+
+def _rewind(file: BinaryIO) -> BinaryIO:
+    file.seek(0)
+    return file
+
+
+def _read_zip_entry(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> BinaryIO:
+    return io.BytesIO(archive.read(info))
+
+
+def expand_uploads(
+    uploads: List[Tuple[str, str, BinaryIO]],
+    max_files: int,
+    max_file_bytes: int,
+    resources: ExitStack,
+) -> List[BatchInput]:
+    """
+    アップロードされたファイルを (ファイル名, 画像のファイルを開く関数) のリストにする
+
+    zip ファイルは中のファイルをそれぞれ 1 枚の画像として扱う。ここでは展開せず、
+    画像を処理するときに 1 ファイルずつ読み込むため、メモリに載るのは処理中の画像だけになる。
+
+    Args:
+        uploads: (ファイル名, Content-Type, ファイル) のリスト
+        max_files: 画像の最大数
+        max_file_bytes: zip から展開する 1 ファイルの最大バイト数
+        resources: 開いた zip ファイルを登録する ExitStack（レスポンスの送信後に閉じる）
+
+    Raises:
+        ValueError: 画像がない場合、画像が max_files を超える場合、
+            または zip の中に max_file_bytes を超えるファイルがある場合
+    """
+    inputs = []
+    for filename, content_type, file in uploads:
+        if not is_zip(filename, content_type):
+            inputs.append((filename, functools.partial(_rewind, file)))
+        else:
+            archive = resources.enter_context(zipfile.ZipFile(file))
+            entries = [
+                info
+                for info in archive.infolist()
+                if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+            ]
+            # 展開する前に件数と展開後のサイズを確認する
+            if len(inputs) + len(entries) > max_files:
+                raise ValueError(
+                    f"Too many images in the request: more than {max_files}"
+                )
+            for info in entries:
+                if info.file_size > max_file_bytes:
+                    raise ValueError(f"{info.filename} exceeds {max_file_bytes} bytes")
+            inputs.extend(
+                (info.filename, functools.partial(_read_zip_entry, archive, info))
+                for info in entries
+            )
+        if len(inputs) > max_files:
+            raise ValueError(f"Too many images in the request: more than {max_files}")
+
+    if not inputs:
+        raise ValueError("No images in the request")
+    return inputs
+
+
+def output_names(inputs: List[BatchInput]) -> List[str]:
+    """入力ファイル名から重複しない出力ファイル名を作る"""
+    names = []
+    seen = set()
+    for filename, _ in inputs:
+        stem = filename.rsplit(".", 1)[0] or "image"
+        name = f"{stem}_nobg.png"
+        index = 1
+        while name in seen:
+            name = f"{stem}_{index}_nobg.png"
+            index += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+async def stream_batch_results(
+    inputs: List[BatchInput],
+    process: Callable[[Callable[[], BinaryIO]], Awaitable[bytes]],
+    concurrency: int,
+    resources: ExitStack,
+) -> AsyncIterator[bytes]:
+    """
+    画像を並行して処理し、完了した順に zip のエントリとして返す
+
+    処理に失敗した画像は、ファイル名とエラーを errors.json にまとめて最後に追加する。
+
+    Args:
+        inputs: (ファイル名, 画像のファイルを開く関数) のリスト
+        process: 画像のファイルを開く関数を受け取り、出力の PNG を返す関数
+        concurrency: 同時に処理する画像の数
+        resources: 入力のファイルを登録した ExitStack（送信が終わったら閉じる）
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def process_one(
+        name: str, open_image_file: Callable[[], BinaryIO]
+    ) -> Tuple[str, bytes, str]:
+        async with semaphore:
+            try:
+                return name, await process(open_image_file), ""
+            except Exception as e:
+                logger.error(f"Error processing image {name}: {str(e)}")
+                return name, b"", str(e)
+
+    tasks = [
+        asyncio.ensure_future(process_one(name, open_image_file))
+        for name, (_, open_image_file) in zip(output_names(inputs), inputs)
+    ]
+    stream = ZipStream()
+    errors = {}
+    try:
+        # PNG は圧縮済みなので、zip では圧縮しない
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+            for task in asyncio.as_completed(tasks):
+                name, output, error = await task
+                if error:
+                    errors[name] = error
+                    continue
+                archive.writestr(name, output)
+                yield stream.drain()
+            if errors:
+                archive.writestr(
+                    "errors.json", json.dumps(errors, ensure_ascii=False, indent=2)
+                )
+        yield stream.drain()
+        logger.info(
+            f"Batch completed: {len(inputs) - len(errors)} succeeded, "
+            f"{len(errors)} failed"
+        )
+    finally:
+        # クライアントが切断した場合は残りの処理を取り消す
+        for task in tasks:
+            task.cancel()
+        resources.close()
@@ -0,0 +1,92 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturatedError(Exception):
+    """実行中と待機中の処理が上限に達している場合のエラー"""
+
+
+class InferenceExecutor:
+    """
+    推論とエンコードをイベントループの外のスレッドで実行する
+
+    - max_workers 個のスレッドで同時に実行する
+    - 実行待ちは max_pending 件までで、それを超えた処理は ExecutorSaturatedError で拒否する
+      （wait=True の処理は拒否せずに空きを待つ）
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 8):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(0, max_pending)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="inference"
+        )
+        # 実行中と待機中の処理数（イベントループからのみ更新する）
+        self.in_flight = 0
+        # 空きを待っている処理（空きができた順に 1 件ずつ起こす）
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.max_workers + self.max_pending
+
+    async def run(
+        self, func: Callable[..., Any], *args: Any, wait: bool = False
+    ) -> Any:
+        """
+        func をスレッドで実行して結果を返す
+
+        Args:
+            wait: True の場合、実行中と待機中の処理が上限に達していれば空きを待つ
+
+        Raises:
+            ExecutorSaturatedError: wait が False で、実行中と待機中の処理が上限に達している場合
+        """
+        if self.saturated:
+            if not wait:
+                raise ExecutorSaturatedError(
+                    f"Too many requests in progress: {self.in_flight}"
+                )
+            await self._wait_for_capacity()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # ログのサンプリングなど、リクエストのコンテキストをスレッドに引き継ぐ
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(context.run, func, *args)
+            )
+        finally:
+            self.in_flight -= 1
+            self._wake_next()
+
+    async def _wait_for_capacity(self) -> None:
+        while self.saturated:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 起こされた後に取り消された場合は、次に待っている処理を起こす
+                    self._wake_next()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+
+    def _wake_next(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
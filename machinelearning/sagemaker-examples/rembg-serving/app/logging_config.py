@@ -0,0 +1,93 @@
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# リクエストの詳細なログ（INFO 以下）を出力するかどうか。リクエストの外では常に出力する
+_request_sampled: contextvars.ContextVar = contextvars.ContextVar(
+    "request_sampled", default=True
+)
+
+
+class RequestSamplingFilter(logging.Filter):
+    """サンプリングされなかったリクエストの INFO 以下のログを捨てる（WARNING 以上は常に出力）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or _request_sampled.get()
+
+
+class LogSamplingMiddleware:
+    """リクエストごとに sample_rate の確率で詳細なログを出力するかを決める ASGI ミドルウェア"""
+
+    def __init__(self, app: ASGIApp, sample_rate: float = 1.0):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            _request_sampled.set(random.random() < self.sample_rate)
+        await self.app(scope, receive, send)
+
+
+def _file_handler(
+    log_file: str, rotation: str, max_bytes: int, backup_count: int, when: str
+) -> logging.Handler:
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            log_file, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+
+
+def setup_logging(
+    logger_name: str = "app",
+    level: int = logging.INFO,
+    log_file: Optional[str] = None,
+) -> logging.handlers.QueueListener:
+    """
+    ロガーにキュー経由のハンドラーを設定する
+
+    ログはキューに積むだけで、ファイルやコンソールへの書き込みは QueueListener の
+    スレッドで行うため、イベントループや推論スレッドがディスクへの書き込みを待たない。
+    ファイルは LOG_ROTATION に応じてサイズ（size）または時刻（time）でローテーションする。
+
+    Returns:
+        logging.handlers.QueueListener: 開始済みのリスナー（終了時に stop を呼ぶ）
+    """
+    log_file = log_file if log_file is not None else os.environ.get("LOG_FILE", "app.log")
+    rotation = os.environ.get("LOG_ROTATION", "size").lower()
+    max_bytes = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+    when = os.environ.get("LOG_ROTATION_WHEN", "midnight")
+
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(
+            _file_handler(log_file, rotation, max_bytes, backup_count, when)
+        )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestSamplingFilter())
+
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    return listener
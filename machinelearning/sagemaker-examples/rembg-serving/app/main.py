@@ -1,51 +1,116 @@
+import asyncio
 import logging
+import os
+import sys
+from contextlib import ExitStack, asynccontextmanager
 from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import io
-from PIL import Image
-from rembg import remove, new_session
+from rembg import remove
 from pathlib import Path
 from pydantic import BaseModel
-from typing import Optional
+from typing import BinaryIO, Callable, List, Optional
 
-# ロガーの設定
+# python app/main.py で直接起動した場合も app パッケージから import できるようにする
+if not __package__:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.batch import expand_uploads, stream_batch_results
+from app.inference_executor import ExecutorSaturatedError, InferenceExecutor
+from app.logging_config import LogSamplingMiddleware, setup_logging
+from app.session_pool import SessionPool
+from app.uploads import (
+    UploadLimitMiddleware,
+    UploadTooLargeError,
+    configure_spooling,
+    copy_to_temp_file,
+    open_image,
+    probe_image,
+)
+
+# ロガーの設定（app 配下のモジュールのログをキュー経由でファイルとコンソールに出力する）
+log_listener = setup_logging("app")
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# ファイルハンドラーの設定
-file_handler = logging.FileHandler('app.log')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-# コンソールハンドラーの設定
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-
-app = FastAPI(title="Background Removal API")
-
-# モデルのセッションを保持する辞書
-model_sessions = {}
-
-def get_model_session(model_name: str = "u2net"):
-    """モデルセッションを取得または作成"""
-    if model_name not in model_sessions:
-        logger.info(f"Creating new model session for {model_name}")
-        models_dir = Path(__file__).parent.parent / "models"
-        model_path = models_dir / f"{model_name}.onnx"
-        if not model_path.exists():
-            logger.error(f"Model file not found: {model_path}")
-            raise FileNotFoundError(f"Model file not found: {model_path}")
-        model_sessions[model_name] = new_session(model_name, model_path=str(model_path))
-        logger.info(f"Successfully created model session for {model_name}")
-    return model_sessions[model_name]
+# リクエストの詳細なログ（INFO 以下）を出力するリクエストの割合
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+
+# 起動時にセッションを作成するモデル（カンマ区切り）
+PRELOAD_MODELS = [
+    name.strip()
+    for name in os.environ.get("PRELOAD_MODELS", "u2net").split(",")
+    if name.strip()
+]
+# モデルごとのセッション数（同時に推論できるリクエスト数）
+SESSIONS_PER_MODEL = int(os.environ.get("SESSIONS_PER_MODEL", "1"))
+
+# 同時に推論するリクエスト数と、推論を待たせておけるリクエスト数
+INFERENCE_CONCURRENCY = int(
+    os.environ.get("INFERENCE_CONCURRENCY", str(SESSIONS_PER_MODEL))
+)
+MAX_PENDING_REQUESTS = int(os.environ.get("MAX_PENDING_REQUESTS", "8"))
+# バッチ API で 1 リクエストに含められる画像の数
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "100"))
+
+# リクエストボディの最大バイト数と、画像の最大画素数（0 で無制限）
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", "50000000"))
+# これを超えるアップロードファイルは一時ファイルに書き出す
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(
+    os.environ.get("UPLOAD_SPOOL_THRESHOLD_BYTES", str(1024 * 1024))
+)
+configure_spooling(UPLOAD_SPOOL_THRESHOLD_BYTES)
+
+# モデルのセッションを保持するプール
+session_pool = SessionPool(
+    Path(__file__).parent.parent / "models", sessions_per_model=SESSIONS_PER_MODEL
+)
+
+# 推論とエンコードを実行するスレッドプール（イベントループをブロックしない）
+inference_executor = InferenceExecutor(
+    max_workers=INFERENCE_CONCURRENCY, max_pending=MAX_PENDING_REQUESTS
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 最初のリクエストがモデルのロードを待たないよう、起動時にセッションを作成する
+    session_pool.preload(PRELOAD_MODELS)
+    logger.info(f"Preloaded models: {session_pool.loaded_models}")
+    yield
+    inference_executor.shutdown()
+    log_listener.stop()
+
+app = FastAPI(title="Background Removal API", lifespan=lifespan)
+app.add_middleware(UploadLimitMiddleware, max_body_bytes=MAX_UPLOAD_BYTES)
+app.add_middleware(LogSamplingMiddleware, sample_rate=LOG_SAMPLE_RATE)
 
 class RemoveBackgroundResponse(BaseModel):
     """背景削除APIのレスポンスモデル"""
     message: str
     error: Optional[str] = None
 
+def remove_background_file(image_file: BinaryIO, model: str) -> bytes:
+    """画像の背景を削除して PNG にエンコードする（推論スレッドで実行）"""
+    # メモリにコピーせず、アップロードされたファイルから直接デコードする
+    input_image = open_image(image_file, MAX_IMAGE_PIXELS)
+
+    # モデルセッションを借りて背景を削除
+    with session_pool.acquire(model) as session:
+        logger.info("Removing background from image")
+        output_image = remove(input_image, session=session)
+        logger.info("Successfully removed background")
+
+    # 画像をバイトストリームに変換
+    img_byte_arr = io.BytesIO()
+    output_image.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+def remove_background_batch_image(
+    open_image_file: Callable[[], BinaryIO], model: str
+) -> bytes:
+    """バッチの画像を開いて背景を削除する（推論スレッドで実行）"""
+    # zip の中の画像はここで初めて読み込む
+    return remove_background_file(open_image_file(), model)
+
 @app.post("/remove-background", response_model=RemoveBackgroundResponse)
 async def remove_background(
     file: UploadFile = File(...),
@@ -63,24 +128,15 @@ async def remove_background(
     """
     logger.info(f"Processing image: {file.filename} with model: {model}")
     try:
-        # 画像を読み込み
-        image_data = await file.read()
-        input_image = Image.open(io.BytesIO(image_data))
-        logger.debug(f"Successfully loaded image: {file.filename}")
-        
-        # モデルセッションを取得
-        session = get_model_session(model)
-        
-        # 背景を削除
-        logger.info("Removing background from image")
-        output_image = remove(input_image, session=session)
-        logger.info("Successfully removed background")
-        
-        # 画像をバイトストリームに変換
-        img_byte_arr = io.BytesIO()
-        output_image.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
+        # ヘッダーだけを読んで、大きすぎる画像はデコードする前に拒否する
+        width, height = probe_image(file.file, MAX_IMAGE_PIXELS)
+        logger.debug(f"Successfully probed image: {file.filename} ({width}x{height})")
+
+        # 推論とエンコードはスレッドで実行し、その間もヘルスチェックやアップロードを受け付ける
+        img_byte_arr = await inference_executor.run(
+            remove_background_file, file.file, model
+        )
+
         # 画像を返す
         logger.info(f"Returning processed image for {file.filename}")
         return Response(
@@ -89,6 +145,25 @@ async def remove_background(
             headers={"Content-Disposition": f"attachment; filename={file.filename.rsplit('.', 1)[0]}_nobg.png"}
         )
         
+    except UploadTooLargeError as e:
+        logger.warning(f"Rejecting image {file.filename}: {str(e)}")
+        return JSONResponse(
+            status_code=413,
+            content=RemoveBackgroundResponse(
+                message="Image is too large",
+                error=str(e)
+            ).model_dump()
+        )
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting image {file.filename}: {str(e)}")
+        return JSONResponse(
+            status_code=429,
+            content=RemoveBackgroundResponse(
+                message="Server is busy, retry later",
+                error=str(e)
+            ).model_dump(),
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         logger.error(f"Error processing image {file.filename}: {str(e)}", exc_info=True)
         return RemoveBackgroundResponse(
@@ -96,6 +171,66 @@ async def remove_background(
             error=str(e)
         )
 
+@app.post("/remove-background/batch")
+async def remove_background_batch(
+    files: List[UploadFile] = File(...),
+    model: str = "u2net"
+) -> Response:
+    """
+    複数の画像の背景をまとめて削除するエンドポイント
+
+    Args:
+        files: アップロードされた画像ファイル（zip の場合は中の画像をすべて処理）
+        model: 使用するモデル名（デフォルト: u2net)
+
+    Returns:
+        処理された画像(PNG形式)の zip。処理が終わった画像から順にストリーミングする
+    """
+    logger.info(f"Processing batch of {len(files)} files with model: {model}")
+    if inference_executor.saturated:
+        return JSONResponse(
+            status_code=429,
+            content=RemoveBackgroundResponse(
+                message="Server is busy, retry later"
+            ).model_dump(),
+            headers={"Retry-After": "1"}
+        )
+
+    # 入力のファイルはレスポンスの送信が終わったら閉じる
+    resources = ExitStack()
+    try:
+        # レスポンスのストリーミング中にアップロードファイルが閉じられるため、
+        # リクエストが持つ一時ファイルにコピーする（メモリには読み込まない）
+        uploads = []
+        for file in files:
+            copy = resources.enter_context(
+                await asyncio.to_thread(copy_to_temp_file, file.file)
+            )
+            uploads.append((file.filename or "image", file.content_type or "", copy))
+        inputs = expand_uploads(uploads, MAX_BATCH_FILES, MAX_UPLOAD_BYTES, resources)
+    except Exception as e:
+        resources.close()
+        logger.error(f"Invalid batch request: {str(e)}")
+        return JSONResponse(
+            status_code=400,
+            content=RemoveBackgroundResponse(
+                message="Invalid batch request",
+                error=str(e)
+            ).model_dump()
+        )
+
+    async def process(open_image_file: Callable[[], BinaryIO]) -> bytes:
+        # 推論スレッドが埋まっている場合は、画像を失敗にせず空きを待つ
+        return await inference_executor.run(
+            remove_background_batch_image, open_image_file, model, wait=True
+        )
+
+    return StreamingResponse(
+        stream_batch_results(inputs, process, INFERENCE_CONCURRENCY, resources),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=nobg.zip"}
+    )
+
 @app.get("/health")
 async def health_check():
     """ヘルスチェックエンドポイント"""
@@ -0,0 +1,93 @@
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from rembg import new_session
+from rembg.sessions.base import BaseSession
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """
+    モデルごとに複数のセッションを保持するプール
+
+    - セッションはモデルごとに sessions_per_model 個作成し、リクエストは空いている
+      セッションを 1 つ借りて使う（同時リクエストが 1 つのセッションで競合しない）
+    - 同じモデルの作成はモデルごとのロックで 1 回にまとめる
+    - preload で起動時にセッションを作成しておく
+    """
+
+    def __init__(self, models_dir: Path, sessions_per_model: int = 1):
+        self.models_dir = models_dir
+        self.sessions_per_model = max(1, sessions_per_model)
+        self._pools: Dict[str, queue.Queue] = {}
+        self._model_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loaded_models(self) -> List[str]:
+        return list(self._pools)
+
+    def preload(self, model_names: List[str]) -> None:
+        """起動時にモデルのセッションを作成する"""
+        for model_name in model_names:
+            try:
+                self._get_pool(model_name)
+            except Exception as e:
+                logger.error(f"Failed to preload model {model_name}: {str(e)}")
+
+    @contextmanager
+    def acquire(
+        self, model_name: str, timeout: Optional[float] = None
+    ) -> Iterator[BaseSession]:
+        """
+        セッションを 1 つ借りる
+
+        Args:
+            model_name: モデル名
+            timeout: 空きセッションを待つ最大秒数（None は無制限）
+
+        Raises:
+            FileNotFoundError: モデルファイルが存在しない場合
+            queue.Empty: timeout までにセッションが空かなかった場合
+        """
+        pool = self._get_pool(model_name)
+        session = pool.get(timeout=timeout)
+        try:
+            yield session
+        finally:
+            pool.put(session)
+
+    def _get_pool(self, model_name: str) -> queue.Queue:
+        pool = self._pools.get(model_name)
+        if pool is not None:
+            return pool
+
+        with self._lock:
+            model_lock = self._model_locks.setdefault(model_name, threading.Lock())
+        # 同じモデルの同時の初回リクエストは、先に作成を始めたリクエストの完了を待つ
+        with model_lock:
+            pool = self._pools.get(model_name)
+            if pool is None:
+                pool = self._create_pool(model_name)
+                self._pools[model_name] = pool
+        return pool
+
+    def _create_pool(self, model_name: str) -> queue.Queue:
+        model_path = self.models_dir / f"{model_name}.onnx"
+        if not model_path.exists():
+            logger.error(f"Model file not found: {model_path}")
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+
+        logger.info(
+            f"Creating {self.sessions_per_model} model sessions for {model_name}"
+        )
+        pool: queue.Queue = queue.Queue()
+        for _ in range(self.sessions_per_model):
+            pool.put(new_session(model_name, model_path=str(model_path)))
+        logger.info(f"Successfully created model sessions for {model_name}")
+        return pool
@@ -0,0 +1,153 @@
+import json
+import logging
+import shutil
+import tempfile
+from typing import BinaryIO, Tuple
+
+from PIL import Image
+from starlette.formparsers import MultiPartParser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLargeError(Exception):
+    """アップロードのサイズや画像の画素数が上限を超えている場合のエラー"""
+
+
+def configure_spooling(threshold: int) -> None:
+    """
+    アップロードファイルをメモリに保持する上限を設定する
+
+    これを超えるファイルは一時ファイルに書き出される（Starlette の SpooledTemporaryFile）。
+    """
+    # Starlette のバージョンによって属性名が異なる
+    if hasattr(MultiPartParser, "spool_max_size"):
+        MultiPartParser.spool_max_size = threshold
+    else:
+        MultiPartParser.max_file_size = threshold
+
+
+def copy_to_temp_file(source: BinaryIO) -> BinaryIO:
+    """
+    アップロードファイルを一時ファイルにコピーする（メモリには読み込まない）
+
+    一時ファイルは閉じると削除される。
+    """
+    target = tempfile.TemporaryFile()
+    try:
+        source.seek(0)
+        shutil.copyfileobj(source, target)
+        target.seek(0)
+    except BaseException:
+        target.close()
+        raise
+    return target
+
+
+def probe_image(image_file: BinaryIO, max_pixels: int) -> Tuple[int, int]:
+    """
+    画像のヘッダーだけを読んでサイズを確認する
+
+    画素データはデコードせず、確認後はファイルの位置を先頭に戻す。
+
+    Raises:
+        UploadTooLargeError: 画素数が max_pixels を超える場合
+    """
+    try:
+        with Image.open(image_file) as probe:
+            width, height = probe.size
+    finally:
+        image_file.seek(0)
+    if max_pixels > 0 and width * height > max_pixels:
+        raise UploadTooLargeError(
+            f"Image is too large: {width}x{height} exceeds {max_pixels} pixels"
+        )
+    return width, height
+
+
+def open_image(image_file: BinaryIO, max_pixels: int) -> Image.Image:
+    """画素数を確認してから、ファイルから直接画像を開く"""
+    probe_image(image_file, max_pixels)
+    return Image.open(image_file)
+
+
+class UploadLimitMiddleware:
+    """
+    リクエストボディのサイズを制限する ASGI ミドルウェア
+
+    Content-Length が max_body_bytes を超える場合はボディを読まずに 413 を返す。
+    Content-Length がない場合も、受信したバイト数が上限を超えた時点で受信をやめて 413 を返す。
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.max_body_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit():
+            if int(content_length) > self.max_body_bytes:
+                logger.warning(f"Rejecting request body of {int(content_length)} bytes")
+                await self._send_too_large(send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    exceeded = True
+                    raise UploadTooLargeError(
+                        f"Request body exceeds {self.max_body_bytes} bytes"
+                    )
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            # 上限を超えた後にアプリが返すエラー（フォームの解析エラーなど）は 413 に置き換える
+            if exceeded:
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._send_too_large(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError as e:
+            logger.warning(f"Rejecting request: {str(e)}")
+            if not response_started:
+                await self._send_too_large(send)
+
+    async def _send_too_large(self, send: Send) -> None:
+        body = json.dumps(
+            {
+                "message": "Request is too large",
+                "error": f"Request body exceeds {self.max_body_bytes} bytes",
+            }
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})